@@ -3,9 +3,10 @@
 import extra_streamlit_components as stx
 import streamlit as st
 
-from utils import display_contact_info, load_maincss, paths, read_config
+from utils import display_contact_info, load_maincss, paths, profile_rerun, read_config, start_dataset_expiry
 
 st.set_page_config(layout='wide')
+start_dataset_expiry()
 load_maincss(paths['maincss'])
 display_contact_info()
 st.sidebar.divider()
@@ -23,8 +24,6 @@ categorize_page = st.Page(
 privacy_policy = st.Page('app_pages/privacy_policy.py', title='Privacy policy', icon=':material/lock:')
 
 
-if 'AgGrid_number' not in st.session_state:  # Needed to reload the AgGrid
-    st.session_state.AgGrid_number = 0
 if 'dashboardconfig' not in st.session_state:  # Set config to the default config
     st.session_state.dashboardconfig = read_config(paths['default_dashboard_config'])
 if 'income_category_index' not in st.session_state:  # needed for the pieplot
@@ -33,27 +32,30 @@ if 'cookie_manager' not in st.session_state:
     st.session_state.cookie_manager = stx.CookieManager()
 if 'file_exists' not in st.session_state:
     st.session_state.file_exists = False
-if 'df_fetched' not in st.session_state:
-    st.session_state.df_fetched = None
+if 'dataset' not in st.session_state:  # The uploaded transactions, prepared for the pages (see `SessionDataset`)
+    st.session_state.dataset = None  # Reopened by the pages that use it (see `get_session_dataset`)
 if 'reload_key' not in st.session_state:
     st.session_state.reload_key = 0
 if 'debug_mode' not in st.session_state:
     st.session_state.debug_mode = False
-if 'data_to_categorize' not in st.session_state:
+if 'data_to_categorize' not in st.session_state:  # The lease on the transactions in the dataset registry
     st.session_state.data_to_categorize = None
+if 'categorized_transactions' not in st.session_state:  # The lease on the transactions, once categorized
+    st.session_state.categorized_transactions = None
 if '_subcategory_to_category' not in st.session_state:
     st.session_state._subcategory_to_category = {}
 if 'config_to_categorize' not in st.session_state:
     st.session_state.config_to_categorize = {'CATEGORIES': {}, 'SUBCATEGORIES': {}}
-if 'updated_categorized_df' not in st.session_state:
-    st.session_state.updated_categorized_df = None
+if 'categorize_edit_log' not in st.session_state:  # The manual edits of the categorized transactions
+    st.session_state.categorize_edit_log = None  # Created on the categorize page, so polars is not imported here
+if 'acknowledged_grid_edit' not in st.session_state:  # The last edit in the categorize grid that has been applied
+    st.session_state.acknowledged_grid_edit = {'grid': None, 'seq': 0}
 
 if st.session_state.debug_mode:
     st.sidebar.write('cookies:', st.session_state.cookie_manager.get_all())
     st.sidebar.write(st.session_state._subcategory_to_category)
     st.sidebar.write(st.session_state.config_to_categorize)
     st.sidebar.write(st.session_state.dashboardconfig)
-    testing_page = st.Page('app_pages/testing.py', title='Testing', icon=':material/lock:')
 
 
 pg = st.navigation([
@@ -63,4 +65,11 @@ pg = st.navigation([
     categorize_page,
     privacy_policy,
 ])
-pg.run()
+if st.session_state.debug_mode:  # Show where the time of the rerun goes
+    with profile_rerun() as profiler:
+        pg.run()
+    from utils import display_profile  # Only imported in debug mode, it imports the dashboard utils
+
+    display_profile(profiler)
+else:
+    pg.run()
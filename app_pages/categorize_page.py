@@ -7,19 +7,30 @@ Users can also overwrite the categorizations manually.
 """
 
 import io
+import math
 
 import pandas as pd
+import polars as pl
 import streamlit as st
 from ruamel.yaml import YAML
 from st_aggrid import AgGrid, GridOptionsBuilder, JsCode
 
 from utils import (
+    EditLog,
+    apply_cell_edits,
     categorize_data,
+    categorize_page_size,
     df_to_excel,
     display_current_categorization_config_structure,
     display_get_configuration_file,
     display_get_transactions_file,
+    get_cell_edits,
+    get_config_fingerprint,
+    get_content_hash,
+    get_dataset_registry,
     paths,
+    profile_stage,
+    row_id_col,
     validate_categorize_mapping_config_format,
     validate_data_after_categorization,
 )
@@ -42,6 +53,9 @@ st.markdown(
 )
 
 yaml = YAML()
+dataset_registry = get_dataset_registry()
+if st.session_state.categorize_edit_log is None:
+    st.session_state.categorize_edit_log = EditLog()
 
 
 (current_structure, upload_config, upload_transactions, categorize_transactions) = st.tabs([
@@ -100,14 +114,31 @@ with upload_transactions:
     data_structure = pd.read_excel(paths['data_structure'])
     st.dataframe(data_structure)
     # Let user upload transactions data
-    example_transactions_data = df_to_excel(pd.read_excel(paths['example_transactions']))
+    with profile_stage('read_excel') as stage:
+        example_transactions = pd.read_excel(paths['example_transactions'])
+        stage.rows_out = len(example_transactions)
+    example_transactions_data = df_to_excel(example_transactions)
     file_path = display_get_transactions_file(
         title='Upload transactions (.xlsx)',
         example_file=example_transactions_data,
     )
     if st.button('Upload the file.'):
         if file_path:
-            st.session_state.data_to_categorize = pd.read_excel(file_path)
+            # The session only keeps a lease on the transactions, they are shared with other sessions that upload
+            # the same file. It is only parsed if it was not uploaded before.
+            content = file_path.getvalue()
+            content_hash = get_content_hash(content)
+            lease = dataset_registry.lease(content_hash)
+            if lease is None:
+                with profile_stage('read_excel') as stage:
+                    transactions = pl.read_excel(content)
+                    stage.rows_out = transactions.height
+                lease = dataset_registry.put(transactions, content_hash)
+            if st.session_state.data_to_categorize is not None:
+                st.session_state.data_to_categorize.release()
+            st.session_state.data_to_categorize = lease
+            # The edits were made to the previous transactions
+            st.session_state.categorize_edit_log.clear()
         else:
             st.error('Please upload a transactions file.')
 
@@ -129,19 +160,49 @@ with categorize_transactions:
             unsafe_allow_html=True,
         )
 
-        if st.session_state.updated_categorized_df is None:
-            categorized_data = categorize_data(
-                st.session_state.data_to_categorize,
-                st.session_state.config_to_categorize,
-            )
-            validate_data_after_categorization(categorized_data)
-            categorized_data = categorized_data.drop(['SUBCATEGORY_COUNT', 'CATEGORY_COUNT'], axis=1)
-        else:
-            categorized_data = st.session_state.updated_categorized_df
+        # The categorized transactions are kept in the dataset registry. The initial categorization is registered on
+        # the transactions and the config, so it is only done again if one of them changes.
+        config_fingerprint = get_config_fingerprint(st.session_state.config_to_categorize)
+        categorized_key = f'{st.session_state.data_to_categorize.key}-{config_fingerprint}'
+        previous_lease = st.session_state.categorized_transactions
+        if previous_lease is None or previous_lease.key != categorized_key:
+            lease = dataset_registry.lease(categorized_key)
+            if lease is None:
+                categorized_data = categorize_data(
+                    dataset_registry.get(st.session_state.data_to_categorize.key).to_pandas(),
+                    st.session_state.config_to_categorize,
+                )
+                validate_data_after_categorization(categorized_data)
+                categorized_data = categorized_data.drop(['SUBCATEGORY_COUNT', 'CATEGORY_COUNT'], axis=1)
+                categorized_data = pl.from_pandas(categorized_data).with_row_index(row_id_col)
+                lease = dataset_registry.put(categorized_data, categorized_key)
+            # The categorization of the previous transactions or config is not shown anymore
+            if previous_lease is not None:
+                previous_lease.release()
+            st.session_state.categorized_transactions = lease
+        # The manual edits are kept in a log, and applied to the categorized transactions
+        edit_log = st.session_state.categorize_edit_log
+        categorized_data = edit_log.materialize(dataset_registry.get(categorized_key))
+
+        col1, col2, col3 = st.columns([1, 1, 6])
+        col1.button('Undo', on_click=edit_log.undo, disabled=not edit_log.can_undo)
+        col2.button('Redo', on_click=edit_log.redo, disabled=not edit_log.can_redo)
+        col3.caption(f'{len(edit_log)} edits')
+
+        # Only one page of the transactions is sent to the grid
+        visible_data = categorized_data
+        if st.checkbox('Only show the transactions without a category'):
+            visible_data = visible_data.filter((pl.col('CATEGORY') == 'UNKNOWN') | (pl.col('SUBCATEGORY') == 'UNKNOWN'))
+        n_pages = max(math.ceil(visible_data.height / categorize_page_size), 1)
+        page = 1
+        if n_pages > 1:
+            page = st.number_input(f'Page (of {n_pages})', min_value=1, max_value=n_pages, value=1)
+        page_data = visible_data.slice((page - 1) * categorize_page_size, categorize_page_size).to_pandas()
 
-        grid_builder = GridOptionsBuilder.from_dataframe(categorized_data)
+        grid_builder = GridOptionsBuilder.from_dataframe(page_data)
         # Make all elements in df editable
         grid_builder.configure_default_column(editable=True, flex=1)
+        grid_builder.configure_column(row_id_col, hide=True, editable=False)
         # Make the subcategory column a dropdown. Not needed for category, as it should
         # be completely dependant on subcategory.
         grid_builder.configure_column(
@@ -150,6 +211,7 @@ with categorize_transactions:
             cellEditorParams={'values': sorted(set(st.session_state.config_to_categorize['SUBCATEGORIES'].keys()))},
         )
         grid_options = grid_builder.build()
+        grid_options['getRowId'] = JsCode(f'function(params) {{ return String(params.data.{row_id_col}); }}')
         # Highlight in red if category is UNKNOWN
         grid_options['defaultColDef']['cellStyle'] = JsCode(
             r"""
@@ -161,28 +223,68 @@ with categorize_transactions:
                 }
         """,
         )
-        categorized_data = AgGrid(
-            data=categorized_data,
+        # Only the edited cells are sent back, not the whole page. Every edit in the grid gets a sequence number. The
+        # grid keeps its edits until the server acknowledges them (in the context of the grid options), so an edit
+        # is sent again if its rerun was interrupted, and the server only applies the edits after the last one it
+        # acknowledged. The grid id tells the edits of a new grid (e.g. after the page is reloaded) apart.
+        acknowledged = st.session_state.acknowledged_grid_edit
+        grid_options['context'] = dict(acknowledged)
+        collect_edits = JsCode(
+            f"""
+            function({{streamlitRerunEventTriggerName, eventData}}) {{
+                const api = eventData.api;
+                api.__grid = api.__grid || `${{Date.now()}}-${{Math.random()}}`;
+                api.__seq = api.__seq || 0;
+                const acknowledged = api.getGridOption('context') || {{}};
+                const seq = acknowledged.grid == api.__grid ? acknowledged.seq : 0;
+                api.__edits = (api.__edits || []).filter((edit) => edit.seq > seq);
+                if (streamlitRerunEventTriggerName == 'cellValueChanged') {{
+                    api.__seq += 1;
+                    api.__edits.push({{
+                        seq: api.__seq,
+                        row_id: eventData.data.{row_id_col},
+                        column: eventData.colDef.field,
+                        old_value: eventData.oldValue,
+                        new_value: eventData.newValue,
+                    }});
+                }}
+                return {{grid: api.__grid, edits: api.__edits}};
+            }}
+        """,
+        )
+        grid_response = AgGrid(
+            data=page_data,
             gridOptions=grid_options,
             allow_unsafe_jscode=True,
-            key=f'grid_{st.session_state.AgGrid_number}',
-        )['data']
+            data_return_mode='CUSTOM',
+            custom_jscode_for_grid_return=collect_edits,
+            update_on=['cellValueChanged'],
+            server_sync_strategy='server_wins',  # The edits are applied to the registered transactions
+            key='categorize_grid',
+        )
+        grid = grid_response.get('grid')
+        last_seq = acknowledged['seq'] if grid == acknowledged['grid'] else 0
+        edits = sorted(
+            (edit for edit in grid_response.get('edits', []) if edit['seq'] > last_seq),
+            key=lambda edit: edit['seq'],
+        )
+        if edits:
+            edit_log.record(edits)
+            categorized_data = apply_cell_edits(categorized_data, edits)
+            st.session_state.acknowledged_grid_edit = {'grid': grid, 'seq': edits[-1]['seq']}
 
         if st.button('Fill in category'):
-            # key has to be renewed for every update
-            st.session_state.AgGrid_number += 1
-            # categorize again.
-            categorized_data = categorize_data(
-                categorized_data,
+            # categorize again. Only the categories that changed are recorded in the log.
+            filled_data = categorize_data(
+                categorized_data.to_pandas(),
                 st.session_state.config_to_categorize,
                 first_time=False,
             )
-            st.session_state.updated_categorized_df = categorized_data
-            st.dataframe(categorized_data)
+            edit_log.record(get_cell_edits(categorized_data, pl.from_pandas(filled_data)))
             st.rerun()
 
         # Let user download the categorized data
-        categorized_data_excel = df_to_excel(categorized_data)
+        categorized_data_excel = df_to_excel(categorized_data.drop(row_id_col).to_pandas())
         # Create a download button
         st.download_button(
             label='Download categorized transactions',
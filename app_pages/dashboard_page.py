@@ -3,74 +3,166 @@
 After users have submited their categorized data, all the visualisations will come here.
 """
 
+from typing import Dict, List, Optional
+
 import polars as pl
 import streamlit as st
 
 from utils import (
     PlotUtils,
-    add_columns,
     display_data,
     display_date_picker,
     display_faq,
+    display_precompute_progress,
     display_sources,
     display_tabs,
     filter_data,
+    get_dashboard_calculations,
     get_first_last_date,
+    get_income_category,
+    get_session_dataset,
     source_col,
+    to_iso_date,
 )
 
-_data = None
-
-if st.session_state.cookie_manager.get(cookie='file_exists'):
-    # If there is a file (logged in or not), we fetch the latest data
-    _data = st.session_state.df_fetched
+dataset = None
 
-if _data is not None:
-    # Instansiate the class that will used to generate the plots based some configuration
-    plot_dashboard_utils = PlotUtils(st.session_state.dashboardconfig)
 
-    # Preprocess the data (_data => data)
-    _data = pl.from_pandas(_data)
-    data = add_columns(_data)
+@st.fragment
+def display_income_outcome_panel(
+    plot_dashboard_utils: PlotUtils,
+    data: pl.LazyFrame,
+    all_sources: List[str],
+    time_frame_col: str,
+    category_col: str,
+) -> None:
+    """Display the sources to select and the income and outcome of the selected sources.
 
-    first_and_last_date = get_first_last_date(data)
-
-    # Give user option to change date range
-    start_date, end_date = display_date_picker(first_and_last_date)
-
-    # Filter data on date range
-    data = filter_data(data, start_date, end_date)
-
-    # Display the data in tabular form.
-    display_data(_data)
-
-    # Get all possible sources within the tiemfeame
-    all_sources = sorted(data.select(source_col).unique().to_series().to_list())
-
-    # Give user option to select a source, timeframe granularity, and category granularity.
+    A fragment: selecting other sources only reruns (and recalculates) this panel, not the whole dashboard.
+    """
+    sources = display_sources(all_sources)
+    plot_dashboard_utils.display_income_outcome(data, sources, time_frame_col, category_col)
+
+
+@st.fragment
+def display_time_frame_panels(
+    plot_dashboard_utils: PlotUtils,
+    data: pl.LazyFrame,
+    balance_index: pl.LazyFrame,
+    all_sources: List[str],
+    start_date: str,
+    end_date: str,
+    goals: Optional[Dict[str, int]],
+    income_category: Optional[str],
+) -> None:
+    """Display the time frame and category tabs, and the panels that change with them.
+
+    These are the net value, the income and outcome and the transactions per category. A fragment: switching tabs
+    only reruns (and recalculates) these panels, not the whole dashboard. The other panels (e.g. the goals heatmap,
+    which is always per month and category) do not depend on the tabs.
+    """
+    # Give user option to select a timeframe granularity and category granularity.
     time_frame_col, category_col = display_tabs()
 
-    # Display the net value of every source as a lineplot and as tiles
-    plot_dashboard_utils.display_net_value(data, time_frame_col, all_sources)
+    # The sources are selected in the income and outcome panel, only its reruns use another selection
+    sources = [source for source in st.session_state.get('sources', all_sources) if source in all_sources]
+
+    # Calculate all the panels in a single query plan
+    plot_dashboard_utils.calculate_all(
+        get_dashboard_calculations(
+            data,
+            balance_index,
+            time_frame_col,
+            category_col,
+            start_date,
+            end_date,
+            sources,
+            goals,
+            income_category,
+        ),
+    )
+
+    # Display the net value of every source as a lineplot and as tiles.
+    # The balances are looked up in the balance index of the whole history, so they don't restart at the start date.
+    plot_dashboard_utils.display_net_value(balance_index, time_frame_col, all_sources, start_date, end_date)
 
     # Display the income and outcome for the selected source over time as a lineplot
     # Display the transactions per category over time as a barplot
-    sources = display_sources(all_sources)
     income_outcome, transactions_per_category = st.columns(2)
     with income_outcome:
-        plot_dashboard_utils.display_income_outcome(data, sources, time_frame_col, category_col)
+        display_income_outcome_panel(plot_dashboard_utils, data, all_sources, time_frame_col, category_col)
     with transactions_per_category:
         plot_dashboard_utils.display_transactions_per_category(data, category_col, time_frame_col)
 
-    # Only plot the heatmap of the goals if goals are provided.
+
+if st.session_state.cookie_manager.get(cookie='file_exists'):
+    # If there is a file (logged in or not), we use the prepared data of the session
+    dataset = get_session_dataset()
+
+if dataset is not None:
+    # All the computations run on the transactions aggregated per day, source, (sub)category and type.
+    # This cube is built once per dataset.
+    cube = dataset.cube
+
+    first_and_last_date = get_first_last_date(cube)
+
+    # Give user option to change date range
+    start_date, end_date = (to_iso_date(date) for date in display_date_picker(first_and_last_date))
+
+    # Right after an upload, the dashboard is still being prepared in the background for all tabs
+    display_precompute_progress(dataset.dataset_id)
+
+    # Instansiate the class that will used to generate the plots based some configuration.
+    # The computations are memoized on the dataset and the date range.
+    plot_dashboard_utils = PlotUtils(
+        st.session_state.dashboardconfig,
+        data_fingerprint=(dataset.dataset_id, start_date, end_date),
+    )
+
+    # Filter data on date range (a slice of the sorted cube). All the panels are lazy queries over this slice.
+    data = filter_data(cube, start_date, end_date).lazy()
+    balance_index = dataset.balance_index.lazy()
+
+    # Get all possible sources within the tiemfeame
+    all_sources = data.select(pl.col(source_col).unique().sort()).collect().to_series().to_list()
+
+    # The sources selected in the income and outcome panel, which the Data Preview starts from
+    sources = [source for source in st.session_state.get('sources', all_sources) if source in all_sources]
+
+    # Display the data of the selected sources in tabular form, searchable through the search index of the dataset
+    display_data(
+        lambda preview_sources: dataset.get_search_index(start_date, end_date, preview_sources),
+        all_sources,
+        sources,
+    )
+
     goals = st.session_state.dashboardconfig.get('goals')
+    show_pieplot = st.session_state.income_category_index is not None
+    # The same income category as the background jobs (see `precompute_dashboard`), so they are found in the cache
+    income_category = (
+        get_income_category(dataset.categories, st.session_state.dashboardconfig) if show_pieplot else None
+    )
+
+    # Display the panels that change with the time frame and category tabs
+    display_time_frame_panels(
+        plot_dashboard_utils,
+        data,
+        balance_index,
+        all_sources,
+        start_date,
+        end_date,
+        goals,
+        income_category,
+    )
+
+    # Only plot the heatmap of the goals if goals are provided. The goals are set per month and category.
     if goals:
-        heatmap = plot_dashboard_utils.display_goals_heatmap(data)
+        heatmap = plot_dashboard_utils.display_goals_heatmap(data, 'YEAR_MONTH', 'CATEGORY')
         heatmap
 
     # Plot pieplot of the income -- only if the income category is known.
-    if st.session_state.income_category_index is not None:
-        pieplot = plot_dashboard_utils.display_pieplot(data)
+    if show_pieplot:
+        pieplot = plot_dashboard_utils.display_pieplot(data, dataset.categories)
         if pieplot is not None:
             _, col_center, _ = st.columns(3)
             with col_center:
@@ -6,21 +6,33 @@ Afterwards, they can change some configurations to personalize their dashboard.
 from typing import Any
 
 import pandas as pd
+import polars as pl
 import streamlit as st
 from streamlit_javascript import st_javascript
 
 from utils import (
-    category_col,
+    SessionDataset,
+    delete_dataset,
     df_to_excel,
     display_get_transactions_file,
     get_checkbox_option,
     get_checkbox_options,
     get_color_picker_options,
+    get_content_hash,
+    get_first_last_date,
+    get_income_category,
     get_number_input_options,
+    get_session_dataset,
+    new_dataset_id,
     paths,
+    plot_point_budget,
+    precompute_dashboard,
+    prepare_transactions_data,
+    profile_stage,
     read_config,
-    source_col,
-    subcategory_col,
+    storage_format_mapping,
+    transaction_store_retention_days,
+    transaction_stores,
     validate_dashboard_config_format,
     validate_transactions_data,
 )
@@ -38,16 +50,19 @@ def _reload() -> None:
     _reload()
 
 
-def handle_file_upload() -> pd.DataFrame | None:
+def handle_file_upload() -> SessionDataset | None:
     """Handle the upload of a file for the dashboard.
 
-    This regards the categorized transactions.
+    This regards the categorized transactions. They are written to the transaction store, and the dataset prepared
+    from that store is returned.
     """
-    next_step = 'Update' if (st.session_state.get('df_fetched') is not None) else 'Upload'
+    next_step = 'Update' if (st.session_state.get('dataset') is not None) else 'Upload'
     col1, _, col2 = st.columns([2, 1, 2])
 
     with col1:
-        example_categorized_transactions = pd.read_excel(paths['example_categorized_transactions'])
+        with profile_stage('read_excel') as stage:
+            example_categorized_transactions = pd.read_excel(paths['example_categorized_transactions'])
+            stage.rows_out = len(example_categorized_transactions)
 
         example_categorized_transactions = df_to_excel(example_categorized_transactions)
 
@@ -59,17 +74,36 @@ def handle_file_upload() -> pd.DataFrame | None:
     st.dataframe(pd.read_excel(paths['categorized_data_structure']))
 
     with col2:
+        # Long histories are better off in the Parquet archive, which only reads the selected months from disk
+        storage_format = st.selectbox('Storage format', options=storage_format_mapping.keys())
+        amounts_in_minor_units = st.checkbox(
+            'Store exact amounts (in cents)',
+            value=True,
+            help='Totals are then exact to the cent. Amounts with more than two decimals are rounded.',
+        )
         if st.button(f'{next_step} the file.'):
             if file_path:
-                df_fetched = pd.read_excel(file_path)
-                df_fetched['DATE'] = df_fetched['DATE'].astype(str)
-                if 'TAG' in df_fetched.columns:  # TODO: dont hardcod
-                    df_fetched['TAG'] = df_fetched['TAG']
-                df_fetched = df_fetched.fillna('')
-                # we should probably not validate twice
-                validate_transactions_data(df_fetched)
+                content = file_path.getvalue()
+                content_hash = get_content_hash(content)
+                with profile_stage('read_excel') as stage:
+                    transactions = pl.read_excel(content)
+                    stage.rows_out = transactions.height
+                validate_transactions_data(transactions, content_hash)
+                store_class = transaction_stores[storage_format_mapping[storage_format]]
+                store = store_class(new_dataset_id())
+                store.write(prepare_transactions_data(transactions, amounts_in_minor_units))
+                # The new upload replaces the previous dataset of the session
+                if st.session_state.dataset is not None:
+                    delete_dataset(st.session_state.dataset.dataset_id)
+                # Build the daily cube, the balance index and the search index of the dataset right away,
+                # and start calculating the dashboard for all the tabs in the background
+                dataset = SessionDataset(store)
+                dataset.get_search_index(*get_first_last_date(dataset.cube))  # The range the dashboard opens on
+                precompute_dashboard(dataset, st.session_state.dashboardconfig)
                 st.session_state.cookie_manager.set('file_exists', True, 'file_exists')
-                return df_fetched
+                # Remember the dataset, so its store can be reopened in a next session
+                st.session_state.cookie_manager.set('dataset_id', store.dataset_id, 'dataset_id')
+                return dataset
             st.error('Please upload a file.')
 
     return None
@@ -94,6 +128,25 @@ def display_reset_dashboardconfig_button() -> None:
         )
 
 
+def display_delete_data_button() -> None:
+    """Button to delete the uploaded transactions from the server. Sets the dataset of the session to None."""
+    col1, col2 = st.columns([1, 4])
+    with col1:
+        if st.button('Delete my data'):
+            delete_dataset(st.session_state.dataset.dataset_id)
+            st.session_state.dataset = None
+            st.session_state.cookie_manager.delete('dataset_id', key='delete_dataset_id')
+            st.session_state.cookie_manager.set('file_exists', False, 'file_exists')
+            with col2:
+                st.success('Your transactions were deleted from the server.')
+            return
+    with col2:
+        st.markdown(
+            f"""Your transactions are kept on the server for {transaction_store_retention_days} days after the upload,
+            so your dashboard can be restored in a next session. You can also delete them right away.""",
+        )
+
+
 def handle_income_category_selection(categories: list[str], config: dict[str, Any]) -> str:
     """Selectbox for the income category.
 
@@ -103,22 +156,17 @@ def handle_income_category_selection(categories: list[str], config: dict[str, An
     # The subcategories from these category will be used to construct the pieplot
     # In the default config we already suggest a category "INCOME".
     # If this is not a category of the user, then show them their first category
-    # as derived by the income_category_index
-    if 'income_category' in config:
-        if config['income_category'] not in categories:
-            st.session_state.income_category_index = 0
-        else:
-            st.session_state.income_category_index = categories.index(config['income_category'])
-    else:
-        st.session_state.income_category_index = 0
+    # as derived by the income_category_index (the same as the background jobs, see `precompute_dashboard`)
+    income_category = get_income_category(categories, config)
+    st.session_state.income_category_index = categories.index(income_category) if income_category is not None else 0
 
     return st.selectbox('Income category', options=categories, index=st.session_state.income_category_index)
 
 
-def display_config_options() -> dict[str, Any]:
+def display_config_options(dataset: SessionDataset) -> dict[str, Any]:
     """Display all the options of the config to customize the dashboard."""
-    categories = sorted(st.session_state.df_fetched[category_col].unique())
-    sources = [*sorted(st.session_state.df_fetched[source_col].unique()), 'Total']
+    categories = dataset.categories
+    sources = [*dataset.sources, 'Total']
 
     st.header('General Settings')
     display_reset_dashboardconfig_button()
@@ -131,6 +179,13 @@ def display_config_options() -> dict[str, Any]:
     )
 
     st.header('Chart Settings')
+    st.session_state.dashboardconfig['plot_point_budget'] = st.number_input(
+        'Maximum number of points per chart',
+        value=st.session_state.dashboardconfig.get('plot_point_budget', plot_point_budget),
+        min_value=100,
+        step=100,
+        help='Long (daily) histories are downsampled to this many points, to keep the charts fast.',
+    )
     st.session_state.dashboardconfig['hidden_categories_from_barplot'] = get_checkbox_options(
         categories,
         st.session_state.dashboardconfig,
@@ -165,10 +220,7 @@ def display_config_options() -> dict[str, Any]:
     )
 
     st.subheader('Pieplot Colors')
-    income_sources = get_income_sources(
-        st.session_state.df_fetched,
-        st.session_state.dashboardconfig['income_category'],
-    )
+    income_sources = dataset.get_subcategories(st.session_state.dashboardconfig['income_category'])
     st.session_state.dashboardconfig['pieplot_colors'] = get_color_picker_options(
         income_sources,
         st.session_state.dashboardconfig,
@@ -191,19 +243,16 @@ def display_config_options() -> dict[str, Any]:
     return st.session_state.dashboardconfig
 
 
-def get_income_sources(transactions_df: pd.DataFrame, income_category: str) -> list[str]:
-    """Get all the subcategories of transactions with category income."""
-    return sorted(transactions_df[transactions_df[category_col] == income_category][subcategory_col].unique())
-
-
 display_header()
 
-df_fetched = None
-
-uploaded_df = handle_file_upload()
-if uploaded_df is not None:
-    st.session_state.df_fetched = uploaded_df
-if st.session_state.df_fetched is not None:  # todo: what is this?
-    validate_transactions_data(st.session_state.df_fetched)
-    updated_config = display_config_options()
+# Reopen the dataset of a previous session, if any, so the page knows whether this is an upload or an update
+get_session_dataset()
+uploaded_dataset = handle_file_upload()
+if uploaded_dataset is not None:
+    st.session_state.dataset = uploaded_dataset
+if st.session_state.dataset is not None:
+    display_delete_data_button()
+if st.session_state.dataset is not None:
+    # No need to validate the transactions again, they were validated before they were written to the store.
+    updated_config = display_config_options(st.session_state.dataset)
     validate_dashboard_config_format(updated_config)
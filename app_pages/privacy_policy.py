@@ -2,14 +2,21 @@
 
 import streamlit as st
 
+from utils import transaction_store_retention_days
+
 st.markdown(
-    """
+    f"""
 # Privacy Policy
 
-Effective Date: 11/2024
+Effective Date: 10/2026
 
-This application stores none of your data. For a more detailed explanation,
-please read the privacy policy of streamlit cloud where this application is hosted.
+This application shares none of your data. The categorized transactions you upload to the dashboard are
+kept in a local store on the server running the application, so that your dashboard can be restored
+in a next session. They are deleted {transaction_store_retention_days} days after the upload, or right away
+when you press 'Delete my data' on the Dashboard Settings page. The transactions you upload to categorize are only kept
+while the application is running; they can be written to temporary files on the server to save memory.
+For a more detailed explanation, please read the privacy policy of streamlit cloud
+where this application is hosted.
 
 For any questions, please contact me at: streamlitfinancedashboard@gmail.com
 """,
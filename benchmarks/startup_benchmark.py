@@ -0,0 +1,135 @@
+"""Startup benchmark: the time to the first render of every page, in a fresh interpreter (a cold start).
+
+Every page is rendered a few times in a new process with Streamlit's AppTest, so the imports are part of the
+measurement. The median time and the heavy libraries that were imported are compared with the baseline in
+`startup_baseline.json`. The benchmark fails if a page got more than `--tolerance` slower, or if it now imports a
+heavy library it did not import before.
+
+The times depend on the machine, so record the baseline on the machine that runs the benchmark:
+
+    $ python benchmarks/startup_benchmark.py --update
+    $ python benchmarks/startup_benchmark.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+baseline_path = os.path.join(root, 'benchmarks', 'startup_baseline.json')
+
+# The pages that can be opened directly. The categorize page has its own url path, which AppTest can only switch
+# to after a first run of the app, so it can not be measured from a cold start.
+pages = {
+    'scripts': None,  # The first page
+    'dashboard': 'app_pages/dashboard_page.py',
+    'dashboard_settings': 'app_pages/dashboard_settings.py',
+    'privacy_policy': 'app_pages/privacy_policy.py',
+}
+heavy_libraries = [
+    'altair',
+    'numpy',
+    'openai',
+    'pandas',
+    'plotly.express',
+    'polars',
+    'pydantic',
+    'ruamel.yaml',
+    'st_aggrid',
+    'streamlit_extras',
+    'streamlit_shadcn_ui',
+]
+
+
+def render_page(page: str) -> Dict[str, Any]:
+    """Render a page of the app in this (fresh) process. Returns the time it took and the libraries imported."""
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest  # Imported here, it is part of the cold start
+
+    app = AppTest.from_file(os.path.join(root, 'app.py'), default_timeout=60)
+    if pages[page] is not None:
+        app.switch_page(pages[page])
+    app.run()
+    return {
+        'seconds': time.perf_counter() - start,
+        'libraries': [library for library in heavy_libraries if library in sys.modules],
+        'exceptions': [exception.value for exception in app.exception],
+    }
+
+
+def measure_page(page: str, repeats: int) -> Dict[str, Any]:
+    """Render a page in `repeats` new processes. Returns the median time and the libraries imported."""
+    runs = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--render', page],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=root,
+            # The scripts page creates an OpenAI client, which needs a key (it is not used to render the page)
+            env={'OPENAI_API_KEY': 'startup-benchmark', **os.environ},
+        )
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    if runs[0]['exceptions']:
+        msg = f'The {page} page raised: {runs[0]["exceptions"]}'
+        raise RuntimeError(msg)
+    return {'seconds': round(statistics.median(run['seconds'] for run in runs), 2), 'libraries': runs[0]['libraries']}
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Compare the results with the baseline. Returns the regressions."""
+    regressions = []
+    for page, result in results.items():
+        if page not in baseline:
+            continue
+        max_seconds = baseline[page]['seconds'] * (1 + tolerance)
+        if result['seconds'] > max_seconds:
+            regressions.append(f'{page}: {result["seconds"]:.2f}s, more than {max_seconds:.2f}s')
+        new_libraries = sorted(set(result['libraries']) - set(baseline[page]['libraries']))
+        if new_libraries:
+            regressions.append(f'{page}: now imports {", ".join(new_libraries)}')
+    return regressions
+
+
+def main() -> int:
+    """Run the benchmark. Returns the exit code: 1 if there are regressions."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5, help='Cold starts per page, the median is used.')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed slowdown, 0.5 is 50%%.')
+    parser.add_argument('--update', action='store_true', help='Save the results as the new baseline.')
+    parser.add_argument('--render', choices=pages.keys(), help=argparse.SUPPRESS)  # Used by the child processes
+    args = parser.parse_args()
+
+    if args.render:
+        print(json.dumps(render_page(args.render)))  # noqa: T201
+        return 0
+
+    results = {page: measure_page(page, args.repeats) for page in pages}
+    for page, result in results.items():
+        print(f'{page:<20} {result["seconds"]:.2f}s  {", ".join(result["libraries"])}')  # noqa: T201
+
+    if args.update:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print('No baseline yet, record one with --update.')  # noqa: T201
+        return 1
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'Regression: {regression}')  # noqa: T201
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,54 +1,187 @@
-from .app_utils import load_maincss
-from .config_utils import read_config, validate_categorize_mapping_config_format, validate_dashboard_config_format
+"""Utils of the app.
+
+The constants and the general app utils are imported right away. The other utils are only imported when they are
+used, so a page only imports the heavy libraries (polars, pandas, plotly, ...) of the utils it uses.
+"""
+
+import importlib
+from typing import Any, Dict, List
+
+from .app_utils import display_contact_info, get_content_hash, load_maincss
 from .constants import (
     amount_col,
+    calculation_cache_max_bytes,
+    categorical_cols,
+    categorize_page_size,
     category_col,
     category_col_mapping,
     colors,
+    data_preview_page_size,
+    dataset_expiry_interval_seconds,
+    dataset_registry_max_bytes,
     date_col,
+    minor_units,
     paths,
+    plot_point_budget,
+    precompute_workers,
+    row_id_col,
+    rule_editor_page_size,
+    search_col,
     source_col,
+    storage_format_mapping,
     subcategory_col,
+    time_frame_format,
+    time_frame_interval,
     time_frame_mapping,
+    transaction_store_retention_days,
     type_col,
+    webgl_min_points,
 )
-from .dashboard_utils import (
-    CalculateUtils,
-    PlotUtils,
-    display_contact_info,
-    display_current_categorization_config_structure,
-    display_data,
-    display_date_picker,
-    display_faq,
-    display_get_configuration_file,
-    display_get_transactions_file,
-    display_sources,
-    display_tabs,
-    get_checkbox_option,
-    get_checkbox_options,
-    get_color_picker_options,
-    get_number_input_options,
-)
-from .data_processing import (
-    add_columns,
-    categorize_data,
-    df_to_excel,
-    filter_data,
-    get_first_last_date,
-    validate_data_after_categorization,
-    validate_transactions_data,
-)
+
+# The utils that are imported when they are used, per module
+_lazy_imports: Dict[str, List[str]] = {
+    'config_utils': [
+        'get_config_fingerprint',
+        'get_config_validation_errors',
+        'parse_config',
+        'read_config',
+        'validate_categorize_mapping_config_format',
+        'validate_dashboard_config_format',
+    ],
+    'cache_utils': [
+        'ByteLRUCache',
+        'estimate_size',
+        'get_calculation_cache',
+        'make_hashable',
+    ],
+    'dataset_registry': [
+        'DatasetLease',
+        'DatasetRegistry',
+        'get_dataset_registry',
+        'get_frame_hash',
+    ],
+    'dataset_retention': [
+        'get_expired_stores',
+        'remove_store_path',
+        'start_dataset_expiry',
+    ],
+    'edit_log': [
+        'EditLog',
+        'get_cell_edits',
+    ],
+    'downsampling': [
+        'downsample_bars',
+        'downsample_lines',
+        'lttb_indices',
+    ],
+    'dashboard_utils': [
+        'CalculateUtils',
+        'PlotUtils',
+        'display_current_categorization_config_structure',
+        'display_data',
+        'display_date_picker',
+        'display_faq',
+        'display_get_configuration_file',
+        'display_get_transactions_file',
+        'display_precompute_progress',
+        'display_profile',
+        'display_sources',
+        'display_tabs',
+        'get_checkbox_option',
+        'get_checkbox_options',
+        'get_color_picker_options',
+        'get_dashboard_calculations',
+        'get_income_category',
+        'get_number_input_options',
+        'precompute_dashboard',
+    ],
+    'data_processing': [
+        'add_columns',
+        'apply_cell_edits',
+        'build_balance_index',
+        'build_daily_cube',
+        'build_search_index',
+        'categorize_data',
+        'df_to_excel',
+        'filter_data',
+        'get_amount_scale',
+        'get_first_last_date',
+        'get_transactions_validation_errors',
+        'prepare_transactions_data',
+        'search_transactions',
+        'to_display_amounts',
+        'to_iso_date',
+        'to_native_types',
+        'validate_data_after_categorization',
+        'validate_transactions_data',
+    ],
+    'profiling': [
+        'Profiler',
+        'profile_rerun',
+        'profile_stage',
+        'profiled',
+    ],
+    'transaction_store': [
+        'SessionDataset',
+        'TransactionStore',
+        'delete_dataset',
+        'delete_expired_datasets',
+        'get_balance_index',
+        'get_daily_cube',
+        'get_search_index',
+        'get_session_dataset',
+        'new_dataset_id',
+        'open_dataset',
+        'open_transaction_store',
+        'transaction_stores',
+    ],
+}
+_lazy_modules = {name: module for module, names in _lazy_imports.items() for name in names}
+
+
+def __getattr__(name: str) -> Any:
+    """Import a util when it is used (PEP 562)."""
+    if name not in _lazy_modules:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_lazy_modules[name]}', __name__), name)
+    globals()[name] = value  # Imported once
+    return value
+
+
+def __dir__() -> List[str]:
+    """All the utils, also the ones that are not imported yet."""
+    return __all__
+
 
 __all__ = [
+    'ByteLRUCache',
     'CalculateUtils',
+    'DatasetLease',
+    'DatasetRegistry',
+    'EditLog',
     'PlotUtils',
+    'Profiler',
+    'SessionDataset',
+    'TransactionStore',
     'add_columns',
     'amount_col',
+    'apply_cell_edits',
+    'build_balance_index',
+    'build_daily_cube',
+    'build_search_index',
+    'calculation_cache_max_bytes',
+    'categorical_cols',
     'categorize_data',
+    'categorize_page_size',
     'category_col',
     'category_col_mapping',
     'colors',
+    'data_preview_page_size',
+    'dataset_expiry_interval_seconds',
+    'dataset_registry_max_bytes',
     'date_col',
+    'delete_dataset',
+    'delete_expired_datasets',
     'df_to_excel',
     'display_contact_info',
     'display_current_categorization_config_structure',
@@ -57,23 +190,73 @@ __all__ = [
     'display_faq',
     'display_get_configuration_file',
     'display_get_transactions_file',
+    'display_precompute_progress',
+    'display_profile',
     'display_sources',
     'display_tabs',
+    'downsample_bars',
+    'downsample_lines',
+    'estimate_size',
     'filter_data',
+    'get_amount_scale',
+    'get_balance_index',
+    'get_calculation_cache',
+    'get_cell_edits',
     'get_checkbox_option',
     'get_checkbox_options',
     'get_color_picker_options',
+    'get_config_fingerprint',
+    'get_config_validation_errors',
+    'get_content_hash',
+    'get_daily_cube',
+    'get_dashboard_calculations',
+    'get_dataset_registry',
+    'get_expired_stores',
     'get_first_last_date',
+    'get_frame_hash',
+    'get_income_category',
     'get_number_input_options',
+    'get_search_index',
+    'get_session_dataset',
+    'get_transactions_validation_errors',
     'load_maincss',
+    'lttb_indices',
+    'make_hashable',
+    'minor_units',
+    'new_dataset_id',
+    'open_dataset',
+    'open_transaction_store',
+    'parse_config',
     'paths',
+    'plot_point_budget',
+    'precompute_dashboard',
+    'precompute_workers',
+    'prepare_transactions_data',
+    'profile_rerun',
+    'profile_stage',
+    'profiled',
     'read_config',
+    'remove_store_path',
+    'row_id_col',
+    'rule_editor_page_size',
+    'search_col',
+    'search_transactions',
     'source_col',
+    'start_dataset_expiry',
+    'storage_format_mapping',
     'subcategory_col',
+    'time_frame_format',
+    'time_frame_interval',
     'time_frame_mapping',
+    'to_display_amounts',
+    'to_iso_date',
+    'to_native_types',
+    'transaction_store_retention_days',
+    'transaction_stores',
     'type_col',
     'validate_categorize_mapping_config_format',
     'validate_dashboard_config_format',
     'validate_data_after_categorization',
     'validate_transactions_data',
+    'webgl_min_points',
 ]
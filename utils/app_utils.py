@@ -1,5 +1,7 @@
 """General utils for the whole app."""
 
+import hashlib
+
 import streamlit as st
 
 
@@ -7,3 +9,21 @@ def load_maincss(file_path: str) -> None:
     """Load and apply CSS styles from a file to the Streamlit app."""
     with open(file_path) as f:
         st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+
+
+def get_content_hash(content: bytes) -> str:
+    """Hash the content of e.g. an uploaded file. Used to identify datasets."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def display_contact_info() -> None:
+    """Display contact information and links in the sidebar."""
+    from streamlit_extras.mention import mention  # Imported here, so importing the utils does not import it
+
+    with st.sidebar:
+        st.markdown(
+            """
+        Get in touch / notify any bugs:
+        """,
+        )
+        mention(label='Narek Arakelyan', icon='github', url='https://github.com/NarekAra')
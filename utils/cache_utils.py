@@ -0,0 +1,124 @@
+"""Caches shared by all sessions."""
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import streamlit as st
+from plotly.basedatatypes import BaseFigure
+
+from utils import calculation_cache_max_bytes
+
+
+# The properties of a trace that hold its data, per point (e.g. the z values of a heatmap, the labels of a pie)
+_trace_data_props = ('x', 'y', 'z', 'text', 'hovertext', 'customdata', 'labels', 'values', 'ids')
+
+
+def _estimate_array_size(values: Any) -> int:
+    """Estimate the size of a data array of a figure in bytes, e.g. a numpy array or a (nested) tuple of labels."""
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values.nbytes
+    if isinstance(values, (list, tuple, np.ndarray)):
+        if len(values) and isinstance(values[0], (list, tuple, np.ndarray)):  # E.g. the rows of a heatmap
+            return sum(map(_estimate_array_size, values))
+        return sum(len(value) if isinstance(value, str) else 8 for value in values)
+    if isinstance(values, str):
+        return len(values)
+    return 8 if values is not None else 0  # A number
+
+
+def _estimate_figure_size(figure: BaseFigure) -> int:
+    """Estimate the size of a figure from the data arrays of its traces, the bulk of what is sent to the browser."""
+    size = 0
+    for trace in figure.data:
+        size += sum(_estimate_array_size(trace[prop]) for prop in _trace_data_props if prop in trace)
+        if 'marker' in trace:  # E.g. a color per point
+            size += _estimate_array_size(trace['marker']['color'])
+    return size
+
+
+def estimate_size(value: Any) -> int:
+    """Estimate the size of a value in bytes."""
+    if isinstance(value, pl.DataFrame):
+        return value.estimated_size()
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, BaseFigure):
+        return _estimate_figure_size(value)
+    return sys.getsizeof(value)
+
+
+def make_hashable(value: Any) -> Hashable:
+    """Make e.g. a list of sources or a dict of goals usable as (part of) a cache key."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, make_hashable(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(make_hashable(item) for item in value)
+    return value
+
+
+class ByteLRUCache:
+    """A least recently used cache, bounded on the (estimated) size of its values in bytes.
+
+    It is thread safe, so one instance can be shared by all sessions.
+    """
+
+    def __init__(self, max_bytes: int):
+        """Initialize an empty cache."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[Hashable, Tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether the key is in the cache."""
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value and mark it as most recently used."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Add a value, evicting the least recently used values until the cache fits in its byte budget."""
+        size = estimate_size(value)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if size > self.max_bytes:  # Would evict everything else and still not fit
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def discard_if(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Remove the values whose key matches, e.g. the ones computed from a dataset that was deleted."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.size -= self._entries.pop(key)[1]
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Get a value, or compute and add it if it is not in the cache."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            # Computed outside of the lock, so other sessions are not blocked in the meantime
+            value = compute()
+            self.set(key, value)
+        return value
+
+
+@st.cache_resource
+def get_calculation_cache() -> ByteLRUCache:
+    """The cache of the dashboard computations, shared by all sessions."""
+    return ByteLRUCache(calculation_cache_max_bytes)
@@ -1,12 +1,16 @@
 """Utils for all related to the configuration files."""
 
+import json
 from typing import Any, Dict, List, Type
 
 import streamlit as st
-from pydantic import BaseModel, StrictBool, ValidationError
-from ruamel.yaml import YAML
+import yaml
+from pydantic import BaseModel, PositiveInt, StrictBool, ValidationError
 
-yaml = YAML()
+from utils import get_content_hash, plot_point_budget
+
+# The configs are only read, so they are parsed with the C loader of libyaml if PyYAML was built with it
+ConfigLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 
 class DashboardConfigData(BaseModel):
@@ -20,6 +24,7 @@ class DashboardConfigData(BaseModel):
     lineplot_width: Dict[str, int]
     income_category: str
     goals: Dict[str, int]
+    plot_point_budget: PositiveInt = plot_point_budget
 
 
 class CategorizeMappingConfigData(BaseModel):
@@ -29,59 +34,86 @@ class CategorizeMappingConfigData(BaseModel):
     SUBCATEGORIES: Dict[str, List[str]]
 
 
+def get_config_fingerprint(config: Dict[str, Any]) -> str:
+    """The content hash of a (parsed) config. Configs with the same content have the same fingerprint."""
+    return get_content_hash(json.dumps(config, sort_keys=True, default=str).encode())
+
+
+@st.cache_data(max_entries=100)
+def get_config_validation_errors(
+    fingerprint: str,  # noqa: ARG001
+    config_data_class_name: str,  # noqa: ARG001
+    _config: Dict[str, Any],
+    _config_data_class: Type[BaseModel],
+) -> List[str]:
+    """Validate a config with a Pydantic model. Returns the errors.
+
+    Cached on the fingerprint of the config (and the name of the model), so reruns with an unchanged config
+    do not validate it again.
+    """
+    try:
+        _config_data_class(**_config)  # Pass data to the Pydantic model for validation
+    except ValidationError as e:
+        return [f'{error["loc"][0]} {error["msg"]}' for error in e.errors()]
+
+    # Check if any key contains an empty list as a value
+    errors = []
+    empty_subcategories = [k for k, v in _config.get('SUBCATEGORIES', {}).items() if len(v) == 0]
+    if empty_subcategories:
+        errors.append(
+            f'Subcateogries {empty_subcategories} do not have any rules.'
+            'Add rules to them or delete the subcategory.',
+        )
+    empty_categories = [k for k, v in _config.get('CATEGORIES', {}).items() if len(v) == 0]
+    if empty_categories:
+        errors.append(
+            f'Categories {empty_categories} do not have any subcategories.'
+            'Add subcategoires to them or delete the category.',
+        )
+    return errors
+
+
+def _validate_config_format(config: Dict[str, Any], config_data_class: Type[BaseModel]) -> None:
+    """Validate the configuration file format. Shows the first error and stops the app if it is not valid."""
+    errors = get_config_validation_errors(
+        get_config_fingerprint(config),
+        config_data_class.__name__,
+        config,
+        config_data_class,
+    )
+    if errors:
+        st.error(errors[0])
+        st.stop()
+
+
 def validate_dashboard_config_format(
     config: Dict[str, Any],
     config_data_class: Type[BaseModel] = DashboardConfigData,
 ) -> None:
     """Validate the configuration file format using a Pydantic model."""
-    try:
-        config_data_class(**config)  # Pass data to the Pydantic model for validation
-
-    except ValidationError as e:
-        for error in e.errors():
-            st.error(error['loc'][0] + ' ' + error['msg'])
-            st.stop()
+    _validate_config_format(config, config_data_class)
 
 
 def validate_categorize_mapping_config_format(
     config: Dict[str, Any],
     config_data_class: Type[BaseModel] = CategorizeMappingConfigData,
 ) -> None:
-    """Validate the configuration file format using a Pydantic model."""
-    try:
-        config_data_class(**config)  # Pass data to the Pydantic model for validation
-
-        # Check if any key contains an empty list as a value
-        for key, value in config.items():
-            if key == 'SUBCATEGORIES':
-                empty_subcategories = [k for k, v in value.items() if len(v) == 0]
-
-                if empty_subcategories != []:
-                    st.error(
-                        f'Subcateogries {empty_subcategories} do not have any rules.'
-                        'Add rules to them or delete the subcategory.',
-                    )
-                    st.stop()
-            if key == 'CATEGORIES':
-                empty_categories = [k for k, v in value.items() if len(v) == 0]
-                if empty_categories != []:
-                    st.error(
-                        f'Categories {empty_categories} do not have any subcategories.'
-                        'Add subcategoires to them or delete the category.',
-                    )
-                    st.stop()
+    """Validate the configuration file format using a Pydantic model, and that no category or subcategory is empty."""
+    _validate_config_format(config, config_data_class)
 
-    except ValidationError as e:
-        for error in e.errors():
-            st.error(error['loc'][0] + ' ' + error['msg'])
-            st.stop()
+
+@st.cache_data(max_entries=10)
+def parse_config(content_hash: str, _content: bytes) -> Dict[str, Any]:  # noqa: ARG001
+    """Parse a YAML configuration, cached on its content hash. Every call gets its own copy of the config."""
+    return yaml.load(_content, Loader=ConfigLoader)
 
 
 def read_config(path: str) -> Dict[str, Any]:
     """Read and parse a YAML configuration file."""
-    with open(path) as stream:
-        try:
-            config = yaml.load(stream)
-        except yaml.YAMLError as exc:
-            st.error(exc)
-    return config
+    with open(path, 'rb') as stream:
+        content = stream.read()
+    try:
+        return parse_config(get_content_hash(content), content)
+    except yaml.YAMLError as exc:
+        st.error(exc)
+        st.stop()
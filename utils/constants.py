@@ -1,13 +1,50 @@
 """Some constants."""
 
 amount_col = 'AMOUNT'
+# Amounts can be stored exactly as integers in minor units (cents). This many minor units make up 1.0.
+minor_units = 100
 date_col = 'DATE'
 source_col = 'SOURCE'
 type_col = 'TYPE'
 category_col = 'CATEGORY'
 subcategory_col = 'SUBCATEGORY'
-time_frame_mapping = {'Monthly': 'YEAR_MONTH', 'Weekly': 'YEAR_WEEK', 'Daily': 'DATE'}
+time_frame_mapping = {
+    'Monthly': 'YEAR_MONTH',
+    'Weekly': 'YEAR_WEEK',
+    'Daily': 'DATE',
+    'Quarterly': 'YEAR_QUARTER',
+    'Yearly': 'YEAR',
+}
+# Every time frame is the date truncated to this interval (a polars duration string)
+time_frame_interval = {'YEAR_MONTH': '1mo', 'YEAR_WEEK': '1w', 'DATE': '1d', 'YEAR_QUARTER': '1q', 'YEAR': '1y'}
+# The time frames are dates (the first day of the period), they are only formatted like this when plotting.
+# Quarters have no strftime directive, they are formatted as e.g. 2024Q1.
+time_frame_format = {'YEAR_MONTH': '%Y-%m', 'YEAR_WEEK': '%GW%V', 'DATE': '%Y-%m-%d', 'YEAR': '%Y'}
+categorical_cols = [source_col, category_col, subcategory_col]
+# Lowercase text of every transaction, to search the transactions in the Data Preview
+search_col = 'SEARCH_TEXT'
+data_preview_page_size = 100
+# The transactions to categorize are identified by their row id, so edits in the grid can be sent as deltas
+row_id_col = 'ROW_ID'
+categorize_page_size = 100
+# The rules of the categorize mapping config are edited one page at a time
+rule_editor_page_size = 50
 category_col_mapping = {'Category': category_col, 'Subcategory': subcategory_col}
+storage_format_mapping = {'SQLite': 'sqlite', 'Parquet archive (long histories)': 'parquet'}
+# Default maximum number of points per chart, the chart data is downsampled to it
+plot_point_budget = 2000
+# Line plots with more points than this are rendered with WebGL
+webgl_min_points = 1000
+# Byte budget of the dashboard computations cached for all sessions
+calculation_cache_max_bytes = 256 * 1024**2
+# Threads that precompute the dashboard of an uploaded dataset in the background
+precompute_workers = 4
+# Byte budget of the datasets of all sessions kept in memory, the least recently used ones are spilled to disk
+dataset_registry_max_bytes = 512 * 1024**2
+# Uploaded datasets are deleted from the transaction store after this many days
+transaction_store_retention_days = 30
+# How often the expired datasets are looked for in the background
+dataset_expiry_interval_seconds = 60 * 60
 colors = ['#07004D', '#42E2B8', '#F3DFBF', '#2D82B7', '#EB8A90']
 paths = {
     'default_dashboard_config': 'static/default_dashboard.yml',
@@ -17,4 +54,6 @@ paths = {
     'data_structure': 'static/raw/data_structure.xlsx',
     'example_categories_mapping_config': 'static/raw/categories_mapping.yml',
     'maincss': 'static/main.css',
+    'transaction_store': '.transaction_store',
+    'dataset_spill': '.dataset_spill',
 }
@@ -1,7 +1,11 @@
 """Dashboard utils."""
 
 import datetime as dt
-from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
 
 import altair as alt
 import pandas as pd
@@ -11,9 +15,46 @@ import polars as pl
 import streamlit as st
 import streamlit_shadcn_ui as ui
 from polars.dataframe import DataFrame
-from streamlit_extras.mention import mention
 
-from utils import amount_col, category_col_mapping, colors, source_col, time_frame_mapping, type_col
+from utils import (
+    Profiler,
+    SessionDataset,
+    amount_col,
+    category_col_mapping,
+    colors,
+    data_preview_page_size,
+    date_col,
+    downsample_bars,
+    downsample_lines,
+    get_calculation_cache,
+    get_config_fingerprint,
+    make_hashable,
+    plot_point_budget,
+    precompute_workers,
+    profile_stage,
+    profiled,
+    rule_editor_page_size,
+    search_col,
+    source_col,
+    time_frame_format,
+    time_frame_interval,
+    time_frame_mapping,
+    type_col,
+    webgl_min_points,
+)
+from utils.data_processing import (
+    filter_data,
+    get_amount_scale,
+    get_first_last_date,
+    search_transactions,
+    to_display_amounts,
+    to_iso_date,
+)
+
+# The calculations can be run eagerly or be part of a lazy query plan
+Frame = TypeVar('Frame', pl.DataFrame, pl.LazyFrame)
+
+logger = logging.getLogger(__name__)
 
 
 class CalculateUtils:
@@ -23,16 +64,21 @@ class CalculateUtils:
 
     - `calculate_transactions_per_category`: Calculates the total transactions per category over time.
     - `calculate_income_outcome`: Calculates the income and outcome balance for a given source over time.
-    - `calculate_net_value`: Calculates the net value for all sources over time.
+    - `calculate_net_value`: Calculates the net value for all sources over time, from the balance index.
+    - `calculate_net_value_tiles`: Calculates the last net value and its change for all sources.
     - `calculate_goals`: Calculates and compares actual spending against predefined spending goals.
+    - `calculate_income_sources`: Calculates the total income per income source (subcategory).
+
+    The amounts can be floats or exact integers in minor units (cents), the aggregations keep their type.
+    Given LazyFrames, the polars calculations return LazyFrames, so they can be collected together.
     """
 
     @staticmethod
     def calculate_transactions_per_category(
-        transactions: pl.DataFrame,
+        transactions: Frame,
         category_col: str,
         time_frame_col: str,
-    ) -> pl.DataFrame:
+    ) -> Frame:
         """Calculates the transactions per category. Aggregated on category and time."""
         transactions = (
             transactions.group_by(time_frame_col, category_col)
@@ -44,17 +90,17 @@ class CalculateUtils:
 
     @staticmethod
     def calculate_income_outcome(
-        transactions: pl.DataFrame,
+        transactions: Frame,
         source: List[str],
         time_frame_col: str,
         category_col: str,
-    ) -> pl.DataFrame:
+    ) -> Frame:
         """Calculates the income and outcome balance for a given source over time."""
         distinct_time = transactions.select(time_frame_col).unique()
         distinct_type = transactions.select(type_col).unique()
         distinct_time_type = distinct_type.join(distinct_time, how='cross')
-        transactions = transactions.filter(transactions[source_col].is_in(source))
-        transactions = transactions.filter(transactions[category_col] != 'TRANSFERS')  # TODO: MAKE THIS A CONSTANT
+        transactions = transactions.filter(pl.col(source_col).is_in(source))
+        transactions = transactions.filter(pl.col(category_col) != 'TRANSFERS')  # TODO: MAKE THIS A CONSTANT
 
         income_outcome = (
             distinct_time_type.join(
@@ -71,126 +117,287 @@ class CalculateUtils:
         return income_outcome
 
     @staticmethod
-    def calculate_net_value(transactions: pl.DataFrame, time_frame_col: str) -> pl.DataFrame:
-        """Calculates the net value for all sources over time."""
-        distinct_sources = transactions.select(source_col).unique()
-        distinct_time = transactions.select(time_frame_col).unique()
+    def _with_time_over_time(net_value: Frame, time_frame_col: str) -> Frame:
+        """Add the ToT (Time over Time) difference with the previous period, or with the opening balance."""
+        previous_net_value = pl.col('NET_VALUE').shift(1).over(source_col).fill_null(pl.col('OPENING'))
+        return (
+            net_value.sort(source_col, time_frame_col)
+            .with_columns((pl.col('NET_VALUE') - previous_net_value).alias('ToT'))
+            .select(time_frame_col, 'NET_VALUE', source_col, 'ToT')
+        )
+
+    @staticmethod
+    def calculate_net_value(
+        balance_index: Frame,
+        time_frame_col: str,
+        start_date: Any,
+        end_date: Any,
+    ) -> Frame:
+        """Calculates the net value of all sources at the end of every period within the date range.
+
+        The net values are looked up in the balance index (see `build_balance_index`), so they are the real balances,
+        including all transactions before the start date. The ToT of the first period is the difference with the
+        balance just before the start date.
+        """
+        start_date = dt.date.fromisoformat(to_iso_date(start_date))
+        end_date = dt.date.fromisoformat(to_iso_date(end_date))
+        interval = time_frame_interval[time_frame_col]
+        first_period = pl.Series([start_date]).dt.truncate(interval).item()
+
+        # The balances are looked up as of the last day of every period (or the end date, for the last period)
+        balance_index = balance_index.rename({date_col: 'LOOKUP_DATE'})
+        sources = balance_index.filter(pl.col('LOOKUP_DATE') <= end_date).select(pl.col(source_col).unique())
+        periods = pl.DataFrame({time_frame_col: pl.date_range(first_period, end_date, interval, eager=True)})
+        if isinstance(balance_index, pl.LazyFrame):
+            periods = periods.lazy()
+        last_day = pl.col(time_frame_col).dt.offset_by(interval).dt.offset_by('-1d')
+
+        def lookup_balance(lookup_dates: Frame) -> Frame:
+            return lookup_dates.sort('LOOKUP_DATE').join_asof(
+                balance_index,
+                on='LOOKUP_DATE',
+                by=source_col,
+                strategy='backward',
+                check_sortedness=False,  # Both are sorted on the dates, the check does not support `by`
+            )
+
+        opening = lookup_balance(
+            sources.with_columns(pl.lit(start_date - dt.timedelta(days=1)).alias('LOOKUP_DATE')),
+        ).select(source_col, pl.col('BALANCE').fill_null(0).alias('OPENING'))
 
         net_value_per_source = (
-            distinct_sources.join(distinct_time, how='cross')
-            .join(
-                transactions.group_by([source_col, time_frame_col])
-                .agg(pl.sum(amount_col).alias('NET_VALUE'))
-                .sort(source_col, time_frame_col)
-                .with_columns(
-                    pl.cum_sum('NET_VALUE')
-                    .sort_by(time_frame_col, descending=False)
-                    .over(source_col)
-                    .alias('NET_VALUE'),
+            lookup_balance(
+                sources.join(periods, how='cross').with_columns(
+                    pl.min_horizontal(last_day, pl.lit(end_date)).alias('LOOKUP_DATE'),
                 ),
-                on=[source_col, time_frame_col],
-                how='left',
             )
-            .sort([source_col, time_frame_col])
-            .with_columns(pl.exclude(source_col).forward_fill().over(source_col))
-            .with_columns((pl.col('NET_VALUE') - pl.col('NET_VALUE').shift(1).over(source_col)).alias('ToT'))
-            .fill_null(0)
-            .select(time_frame_col, 'NET_VALUE', source_col, 'ToT')
+            .with_columns(pl.col('BALANCE').fill_null(0).alias('NET_VALUE'))
+            .join(opening, on=source_col)
         )
 
         net_value_total = (
             net_value_per_source.group_by(time_frame_col)
-            .agg(pl.sum('NET_VALUE').alias('NET_VALUE'))
-            .with_columns(pl.lit('Total').alias(source_col))
-            .sort(time_frame_col)
-            .fill_null(0)
-            .with_columns((pl.col('NET_VALUE') - pl.col('NET_VALUE').shift(1).over(source_col)).alias('ToT'))
-            .fill_null(0)
-            .select(time_frame_col, 'NET_VALUE', source_col, 'ToT')
+            .agg(pl.sum('NET_VALUE'), pl.sum('OPENING'))
+            .with_columns(pl.lit('Total', dtype=pl.Categorical).alias(source_col))
         )
 
-        net_value = pl.concat([net_value_total, net_value_per_source])
+        net_value = pl.concat(
+            [
+                CalculateUtils._with_time_over_time(net_value_total, time_frame_col),
+                CalculateUtils._with_time_over_time(net_value_per_source, time_frame_col),
+            ],
+        )
 
         return net_value
 
     @staticmethod
-    def calculate_goals(transactions: pl.DataFrame, goal_spending: Dict[str, int]) -> pd.DataFrame:
-        """Calculate and compare actual spending against predefined goals."""
-        # Normalize goal spending data
-        normalized_data = list(goal_spending.items())
-        goals_df = pd.DataFrame(normalized_data, columns=['CATEGORY', 'MAX_AMOUNT'])
+    def calculate_net_value_tiles(
+        balance_index: Frame,
+        time_frame_col: str,
+        start_date: Any,
+        end_date: Any,
+    ) -> Frame:
+        """Calculates the net value of all sources in the last period, with the ToT difference with the period before.
+
+        One row per source (and the total), in one aggregation over the net value. Lazily, the net value is shared
+        with the line plot.
+        """
+        net_value = CalculateUtils.calculate_net_value(balance_index, time_frame_col, start_date, end_date)
+        tiles = (
+            net_value.group_by(source_col)
+            .agg(pl.col('NET_VALUE', 'ToT').sort_by(time_frame_col).last())
+            .select(source_col, 'NET_VALUE', 'ToT')
+        )
+        return tiles
+
+    @staticmethod
+    def calculate_goals(
+        transactions: Frame,
+        goal_spending: Dict[str, int],
+        time_frame_col: str = 'YEAR_MONTH',
+        category_col: str = 'CATEGORY',
+    ) -> Frame:
+        """Calculate and compare actual spending against predefined goals.
+
+        A goal is the maximum amount to spend on a category (or subcategory) per period (month, week, ...). Every
+        period between the first and the last period with spending is evaluated, so also the periods without any.
+        """
+        goals = pl.DataFrame(
+            {
+                category_col: list(goal_spending.keys()),
+                'MAX_AMOUNT': [amount * get_amount_scale(transactions) for amount in goal_spending.values()],
+            },
+            schema_overrides={category_col: pl.String},
+        )
         # Calculate actual spending per category
         actual_spending = CalculateUtils.calculate_transactions_per_category(
             transactions,
-            'CATEGORY',
-            'YEAR_MONTH',
-        ).to_pandas()
-
-        # Determine the date range
-        min_date, max_date = (actual_spending['YEAR_MONTH'].min(), actual_spending['YEAR_MONTH'].max())
-
-        # Create a complete date range DataFrame
-        date_range = pd.date_range(start=min_date, end=max_date, freq='MS').strftime('%Y-%m').tolist()
-        date_range_df = pd.DataFrame(date_range, columns=['YEAR_MONTH'])
-
-        # Create all possible combinations of YEAR_MONTH and CATEGORY
-        all_combinations = pd.MultiIndex.from_product(
-            [date_range_df['YEAR_MONTH'], actual_spending['CATEGORY'].unique()],
-            names=['YEAR_MONTH', 'CATEGORY'],
-        )
-        all_combinations_df = pd.DataFrame(index=all_combinations).reset_index()
-
-        # Merge actual spending with all combinations to fill missing months/categories with 0
-        actual_spending = all_combinations_df.merge(
-            actual_spending,
-            on=['CATEGORY', 'YEAR_MONTH'],
-            how='left',
-        ).fillna(0)
-
-        # Merge actual spending with goal data
-        comparison = actual_spending.merge(goals_df, on='CATEGORY', how='inner')
-
-        # Determine if goals were achieved
-        comparison['GOAL_ACHIEVED'] = -comparison['MAX_AMOUNT'] < comparison['AMOUNT']
-
-        # Add a human-readable month column
-        comparison['MONTH'] = pd.to_datetime(comparison['YEAR_MONTH']).dt.strftime('%B %Y')
-
-        # Create a pivot table to summarize goal achievements per month and category
-        pivot_table_goals = (
-            pd.pivot_table(
-                comparison,
-                values='GOAL_ACHIEVED',
-                index=['MONTH', 'YEAR_MONTH'],
-                columns='CATEGORY',
-                aggfunc='sum',
+            category_col,
+            time_frame_col,
+        ).with_columns(pl.col(category_col).cast(pl.String))
+
+        # Generate all the periods between the first and the last one (none if there was no spending at all)
+        periods = (
+            actual_spending.select(
+                pl.date_ranges(
+                    pl.col(time_frame_col).min(),
+                    pl.col(time_frame_col).max(),
+                    time_frame_interval[time_frame_col],
+                ).alias(time_frame_col),
             )
-            .sort_values('YEAR_MONTH')
-            .reset_index(level='YEAR_MONTH')
-            .drop(columns=['YEAR_MONTH'], axis=1)
-            .T
+            .explode(time_frame_col)
+            .drop_nulls()
+        )
+        if isinstance(transactions, pl.LazyFrame):
+            goals = goals.lazy()
+
+        # Evaluate every goal in every period, the periods without spending have spent 0
+        goals_achieved = (
+            periods.join(goals, how='cross')
+            .join(actual_spending, on=[time_frame_col, category_col], how='left')
+            .with_columns(pl.col(amount_col).fill_null(0))
+            .with_columns((-pl.col('MAX_AMOUNT') < pl.col(amount_col)).alias('GOAL_ACHIEVED'))
+            .sort(category_col, time_frame_col)
+            .select(time_frame_col, category_col, amount_col, 'MAX_AMOUNT', 'GOAL_ACHIEVED')
         )
 
-        return pivot_table_goals
+        return goals_achieved
+
+    @staticmethod
+    def calculate_income_sources(transactions: Frame, income_category: str) -> Frame:
+        """Calculates the total income per income source (the subcategories of the income category)."""
+        income_sources = (
+            transactions.filter(pl.col('CATEGORY') == income_category)
+            .group_by('SUBCATEGORY')
+            .agg(pl.sum('AMOUNT').alias('AMOUNT'))
+            .filter(pl.col('AMOUNT') > 0)
+            .sort('SUBCATEGORY')
+        )
+        return income_sources
 
 
 class PlotUtils:
     """Functions for plotting."""
 
-    def __init__(self, config_file: Dict[str, Any]):
-        """Initialize the PlotUtils class."""
+    def __init__(self, config_file: Dict[str, Any], data_fingerprint: Optional[Hashable] = None):
+        """Initialize the PlotUtils class.
+
+        Args:
+            config_file (Dict[str, Any]): The dashboard config.
+            data_fingerprint (Optional[Hashable]): Identifies the transactions that will be displayed, e.g. the
+                dataset id and the date range. If given, the computations are memoized in the calculation cache
+                shared by all sessions, so a widget change only recomputes the panel it affects.
+        """
         self.config_file = config_file
+        self.data_fingerprint = data_fingerprint
+        # Looked up once, so the calculations can also run on other threads (see `precompute_dashboard`)
+        self._cache = get_calculation_cache() if data_fingerprint is not None else None
+        # Results of `calculate_all` when there is no fingerprint to cache them on
+        self._results: Dict[Hashable, Any] = {}
         if 'lineplot_colors' not in self.config_file:
             self.config_file['lineplot_colors'] = {}
         if 'lineplot_width' not in self.config_file:
             self.config_file['lineplot_width'] = {}
         if 'hidden_categories_from_barplot' not in self.config_file:
             self.config_file['hidden_categories_from_barplot'] = []
+        if 'plot_point_budget' not in self.config_file:
+            self.config_file['plot_point_budget'] = plot_point_budget
+
+    def _calculation_key(self, calculation: Callable[..., Any], args: Tuple[Any, ...]) -> Hashable:
+        return (calculation.__name__, self.data_fingerprint, *(make_hashable(arg) for arg in args))
 
-    def _plot_net_value_line_plot(self, transactions: DataFrame, time_frame_col: str) -> None:
-        """Plot a line plot of net value for all sources over time."""
-        # Assuming df, time_frame_col, and SOURCE_COL are defined
-        fig = px.line(transactions, x=time_frame_col, y='NET_VALUE', color=source_col)
+    def _get_result(self, key: Hashable, default: Any = None) -> Any:
+        if self.data_fingerprint is None:
+            return self._results.get(key, default)
+        return self._cache.get(key, default)
+
+    def _set_result(self, key: Hashable, result: Any) -> None:
+        if self.data_fingerprint is None:
+            self._results[key] = result
+        else:
+            self._cache.set(key, result)
+
+    def _calculate(self, calculation: Callable[..., Any], transactions: Frame, *args: Any) -> Any:
+        """Run one of the CalculateUtils computations, memoized on the data fingerprint and the other arguments."""
+        key = self._calculation_key(calculation, args)
+        missing = object()
+        result = self._get_result(key, missing)
+        if result is missing:
+            with profile_stage(f'CalculateUtils.{calculation.__name__}') as stage:
+                result = calculation(transactions, *args)
+                if isinstance(result, pl.LazyFrame):
+                    result = result.collect()
+                stage.rows_out = result.height if isinstance(result, pl.DataFrame) else None
+            self._set_result(key, result)
+        return result
+
+    @profiled
+    def calculate_all(self, calculations: List[Tuple[Any, ...]]) -> None:
+        """Run CalculateUtils computations as a single query plan, before displaying them.
+
+        Every calculation is given as a tuple (calculation, transactions, *args), like `_calculate`. Given LazyFrames
+        over one shared source (e.g. the filtered daily cube), the calculations that are not cached yet are collected
+        together with `pl.collect_all`. Polars then shares the scan and the common subplans, and runs the
+        aggregations in parallel. The display methods afterwards find their results in the cache.
+        """
+        missing = object()
+        pending = {}
+        for calculation, transactions, *args in calculations:
+            key = self._calculation_key(calculation, tuple(args))
+            if key in pending or self._get_result(key, missing) is not missing:
+                continue
+            result = calculation(transactions, *args)
+            if isinstance(result, pl.LazyFrame):
+                pending[key] = result
+            else:
+                self._set_result(key, result)
+        for key, result in zip(pending, pl.collect_all(pending.values())):
+            self._set_result(key, result)
+
+    def _get_figure(
+        self,
+        plot: Callable[..., go.Figure],
+        data_key: Hashable,
+        styling: Tuple[str, ...],
+        *args: Any,
+    ) -> go.Figure:
+        """Plot a figure, or get it from the cache if its data and styling did not change.
+
+        The figure is cached on the key of the calculation it plots (see `_calculation_key`) and the options of the
+        config it is styled with. A cached figure is not built (and styled) again, only sent to the browser.
+        """
+        if self.data_fingerprint is None:
+            return plot(*args)
+        key = ('figure', plot.__name__, data_key, *(make_hashable(self.config_file.get(option)) for option in styling))
+        return self._cache.get_or_compute(key, lambda: plot(*args))
+
+    @staticmethod
+    def _format_time_frame(transactions: DataFrame, time_frame_col: str) -> DataFrame:
+        """Format the time frame (a date) as a label, e.g. 2024-01 for a month or 2024W01 for a week."""
+        time_frame = pl.col(time_frame_col)
+        if time_frame_col in time_frame_format:
+            label = time_frame.dt.strftime(time_frame_format[time_frame_col])
+        else:
+            label = pl.format('{}Q{}', time_frame.dt.year(), time_frame.dt.quarter())
+        return transactions.with_columns(label.alias(time_frame_col))
+
+    def _plot_net_value_line_plot(self, transactions: DataFrame, time_frame_col: str) -> go.Figure:
+        """Plot a line plot of net value for all sources over time. Long series are rendered with WebGL."""
+        transactions = downsample_lines(
+            transactions,
+            time_frame_col,
+            'NET_VALUE',
+            source_col,
+            self.config_file['plot_point_budget'],
+        )
+        transactions = to_display_amounts(self._format_time_frame(transactions, time_frame_col), ['NET_VALUE'])
+        fig = px.line(
+            transactions,
+            x=time_frame_col,
+            y='NET_VALUE',
+            color=source_col,
+            render_mode='webgl' if transactions.height > webgl_min_points else 'svg',
+        )
 
         # Update traces with custom colors and line widths
         for trace in fig.data:
@@ -204,12 +411,23 @@ class PlotUtils:
 
         # Update layout
         fig.update_layout(yaxis_title='Net value')
+        return fig
 
-        # Plot the figure with Streamlit
-        st.plotly_chart(fig, use_container_width=True)
-
-    def _plot_transactions_per_category(self, transactions: DataFrame, category_col: str, time_frame_col: str) -> None:
+    def _plot_transactions_per_category(
+        self,
+        transactions: DataFrame,
+        category_col: str,
+        time_frame_col: str,
+    ) -> go.Figure:
         """Plot a bar plot of transactions per category."""
+        transactions = downsample_bars(
+            transactions,
+            time_frame_col,
+            amount_col,
+            category_col,
+            self.config_file['plot_point_budget'],
+        )
+        transactions = to_display_amounts(self._format_time_frame(transactions, time_frame_col), [amount_col])
         fig = px.bar(
             transactions,
             x=time_frame_col,
@@ -225,28 +443,34 @@ class PlotUtils:
             for trace in fig_go.data
             if trace.name in self.config_file['hidden_categories_from_barplot']
         ]
+        return fig_go
 
-        st.plotly_chart(fig_go, use_container_width=True)
-
-    def _plot_lineplot_income_outcome(self, transactions: DataFrame, time_frame_col: str) -> None:
+    def _plot_lineplot_income_outcome(self, transactions: DataFrame, time_frame_col: str) -> go.Figure:
         """Plot a line plot of income and outcome for a given source over time."""
+        transactions = downsample_bars(
+            transactions,
+            time_frame_col,
+            amount_col,
+            type_col,
+            self.config_file['plot_point_budget'],
+        )
+        transactions = to_display_amounts(self._format_time_frame(transactions, time_frame_col), [amount_col])
         fig = px.bar(transactions, x=time_frame_col, y=amount_col, color=type_col, barmode='group')
         fig.update_layout(yaxis_title='Amount')
-        st.plotly_chart(fig, use_container_width=True)
+        return fig
 
-    def _plot_net_value_tiles(self, transactions: DataFrame, time_frame_col: str, all_sources: List[str]) -> None:
+    def _plot_net_value_tiles(self, transactions: DataFrame, all_sources: List[str]) -> None:
         """Plot tiles of the net value for all sources.
 
-        For the most recent timeframe and a ToT (Time over Time) difference with the previous timeframe.
+        For the most recent timeframe and a ToT (Time over Time) difference with the previous timeframe, as calculated
+        by `calculate_net_value_tiles`. A source without a net value has a net value of 0.
         """
-        last_period = transactions.select(pl.col(time_frame_col).max()).item()
-        transactions = transactions.filter(pl.col(time_frame_col) == last_period)
+        transactions = to_display_amounts(transactions, ['NET_VALUE', 'ToT'])
+        tiles = {source: (net_value, ToT) for source, net_value, ToT in transactions.iter_rows()}
         n_cols = 3
         cols = st.columns(n_cols)
         for i, source in enumerate([*all_sources, 'Total']):
-            source_data = transactions.filter(pl.col(source_col) == source)
-            net_value_source = source_data.select('NET_VALUE').item()
-            ToT_net_value_source = source_data.select('ToT').item()
+            net_value_source, ToT_net_value_source = tiles.get(source, (0, 0))
             with cols[i % n_cols]:
                 ui.metric_card(
                     source,
@@ -256,7 +480,7 @@ class PlotUtils:
 
     def plot_pieplot(self, transactions: DataFrame) -> alt.Chart:
         """Plot a pie chart of the data."""
-        transactions = transactions.to_pandas()
+        transactions = to_display_amounts(transactions, [amount_col]).to_pandas()
         operation_select = alt.selection_single(fields=['SUBCATEGORY'], empty='all')
         if self.config_file['pieplot_colors']:
             scale = alt.Scale(
@@ -279,75 +503,107 @@ class PlotUtils:
         )
         return pie_plot
 
-    def _plot_goals_heatmap(self, transactions: DataFrame) -> go.Figure:
+    def _plot_goals_heatmap(
+        self,
+        transactions: DataFrame,
+        time_frame_col: str = 'YEAR_MONTH',
+        category_col: str = 'CATEGORY',
+    ) -> go.Figure:
         """Plot a heatmap of goal achievements."""
         colorscale = [  # "ylgn" colorscale
             [0, 'rgb(255,255,229)'],
             [1, 'rgb(0,69,41)'],
         ]
-        hovertext = [
-            [
-                f'Month: {month}<br>Category: {category}<br>Goal: {"ACHIEVED" if value == 1 else "NOT ACHIEVED"}'
-                for month, value in zip(transactions.columns, values)
-            ]
-            for category, values in transactions.iterrows()
-        ]
+        if time_frame_col == 'YEAR_MONTH':
+            transactions = transactions.with_columns(pl.col(time_frame_col).dt.strftime('%B %Y'))
+            period_name = 'Month'
+        else:
+            transactions = self._format_time_frame(transactions, time_frame_col)
+            period_name = 'Period'
+        transactions = transactions.with_columns(
+            pl.col('GOAL_ACHIEVED').cast(pl.Int8),
+            pl.format(
+                f'{period_name}: {{}}<br>{category_col.title()}: {{}}<br>Goal: {{}}',
+                time_frame_col,
+                category_col,
+                pl.when('GOAL_ACHIEVED').then(pl.lit('ACHIEVED')).otherwise(pl.lit('NOT ACHIEVED')),
+            ).alias('HOVERTEXT'),
+        )
+
+        # One row per category and one column per period, in the (sorted) order of the transactions.
+        # PD010 is about the pandas pivot, these are polars frames.
+        goals_achieved = transactions.pivot(on=time_frame_col, index=category_col, values='GOAL_ACHIEVED')  # noqa: PD010
+        hovertext = transactions.pivot(on=time_frame_col, index=category_col, values='HOVERTEXT')  # noqa: PD010
+        periods = goals_achieved.columns[1:]
+        categories = goals_achieved.get_column(category_col).to_list()
 
         heatmap = go.Heatmap(
-            z=transactions,
+            z=goals_achieved.drop(category_col).to_numpy(),
             colorscale=colorscale,
-            x=list(transactions.columns),
-            y=list(transactions.index),
+            x=periods,
+            y=categories,
             hoverinfo='text',
-            text=hovertext,
+            text=hovertext.drop(category_col).to_numpy(),
             showscale=False,
         )
 
-        # Get the years
-        years = [x for x in list(transactions.columns) if 'January' in x]
         offset = 0.5
 
-        # Create a list of lines, one for each year
-        scatter_lines = [
-            {
-                'type': 'line',
-                'x0': i,
-                'y0': -offset,
-                'x1': i,
-                'y1': len(list(transactions.index)) - offset,
-                'line': {'color': '#DDDDDD', 'width': 2},
-            }
-            for i in years
-        ]
-
+        # Create a list of lines, one between every category
         scatter_lines = [
             {
                 'type': 'line',
                 'x0': -offset,
                 'y0': i + offset,
-                'x1': len(list(transactions.columns)) - offset,
+                'x1': len(periods) - offset,
                 'y1': i + offset,
                 'line': {'color': '#DDDDDD', 'width': 2},
             }
-            for i in range(len(list(transactions.index)) - 1)
+            for i in range(len(categories) - 1)
         ]
 
         layout = go.Layout(shapes=scatter_lines)
         fig = go.Figure(data=[heatmap], layout=layout)
         return fig
 
-    def display_net_value(self, transactions: pl.DataFrame, time_frame_col: str, all_sources: List[str]) -> None:
-        """Display the net value as a line plot over time and as tiles."""
-        net_value = CalculateUtils.calculate_net_value(transactions, time_frame_col)
+    @profiled
+    def display_net_value(
+        self,
+        balance_index: Frame,
+        time_frame_col: str,
+        all_sources: List[str],
+        start_date: Any,
+        end_date: Any,
+    ) -> None:
+        """Display the net value within the date range as a line plot over time and as tiles.
+
+        Args:
+            balance_index (Frame): The balance index of the whole history (see `build_balance_index`).
+            time_frame_col (str): Name of the column containing time frame information.
+            all_sources (List[str]): The sources to display a tile for.
+            start_date (Any): Start of the date range.
+            end_date (Any): End of the date range.
+        """
+        args = (time_frame_col, start_date, end_date)
+        net_value = self._calculate(CalculateUtils.calculate_net_value, balance_index, *args)
         a, b = st.columns([6, 4])
         with a:
-            self._plot_net_value_line_plot(net_value, time_frame_col)
+            fig = self._get_figure(
+                self._plot_net_value_line_plot,
+                self._calculation_key(CalculateUtils.calculate_net_value, args),
+                ('lineplot_colors', 'lineplot_width', 'plot_point_budget'),
+                net_value,
+                time_frame_col,
+            )
+            st.plotly_chart(fig, use_container_width=True)
         with b:
-            self._plot_net_value_tiles(net_value, time_frame_col, all_sources)
+            tiles = self._calculate(CalculateUtils.calculate_net_value_tiles, balance_index, *args)
+            self._plot_net_value_tiles(tiles, all_sources)
 
+    @profiled
     def display_income_outcome(
         self,
-        transactions: pl.DataFrame,
+        transactions: Frame,
         source: List[str],
         time_frame_col: str,
         category_col: str,
@@ -355,69 +611,217 @@ class PlotUtils:
         """Display the income and outcome for the selected source over time as a lineplot.
 
         Args:
-            transactions (pl.DataFrame): Input DataFrame containing transaction data.
+            transactions (Frame): Input (Lazy)DataFrame containing transaction data.
             source (List[str]): List of source names to filter the data.
             time_frame_col (str): Name of the column containing time frame information.
             category_col (str): Name of the column containing category information.
         """
-        income_outcome = CalculateUtils.calculate_income_outcome(transactions, source, time_frame_col, category_col)
-        self._plot_lineplot_income_outcome(income_outcome, time_frame_col)
+        args = (source, time_frame_col, category_col)
+        income_outcome = self._calculate(CalculateUtils.calculate_income_outcome, transactions, *args)
+        fig = self._get_figure(
+            self._plot_lineplot_income_outcome,
+            self._calculation_key(CalculateUtils.calculate_income_outcome, args),
+            ('plot_point_budget',),
+            income_outcome,
+            time_frame_col,
+        )
+        st.plotly_chart(fig, use_container_width=True)
 
+    @profiled
     def display_transactions_per_category(
         self,
-        transactions: pl.DataFrame,
+        transactions: Frame,
         category_col: str,
         time_frame_col: str,
     ) -> None:
         """Display the transactions per category over time as a barplot.
 
         Args:
-            transactions (pl.DataFrame): Input DataFrame containing transaction data.
+            transactions (Frame): Input (Lazy)DataFrame containing transaction data.
             category_col (str): Name of the column containing category information.
             time_frame_col (str): Name of the column containing time frame information.
         """
-        transactions_per_category = CalculateUtils.calculate_transactions_per_category(
+        args = (category_col, time_frame_col)
+        transactions_per_category = self._calculate(
+            CalculateUtils.calculate_transactions_per_category,
             transactions,
+            *args,
+        )
+        fig = self._get_figure(
+            self._plot_transactions_per_category,
+            self._calculation_key(CalculateUtils.calculate_transactions_per_category, args),
+            ('hidden_categories_from_barplot', 'plot_point_budget'),
+            transactions_per_category,
             category_col,
             time_frame_col,
         )
-        self._plot_transactions_per_category(transactions_per_category, category_col, time_frame_col)
+        st.plotly_chart(fig, use_container_width=True)
 
-    def display_pieplot(self, transactions: pl.DataFrame) -> alt.Chart:
+    @profiled
+    def display_pieplot(self, transactions: Frame, categories: List[str]) -> alt.Chart:
         """Display a pie plot of income sources.
 
         Args:
-            transactions (pl.DataFrame): Input DataFrame containing transaction data.
+            transactions (Frame): Input (Lazy)DataFrame containing transaction data.
+            categories (List[str]): The categories of the dataset, to pick the income category from
+                (see `get_income_category`).
 
         Returns:
             alt.Chart: Altair chart object representing the pie plot, or None if no data is available.
         """
-        data = (
-            transactions.filter(pl.col('CATEGORY') == self.config_file['income_category'])
-            .group_by('SUBCATEGORY')
-            .agg(pl.sum('AMOUNT').alias('AMOUNT'))
-            .filter(pl.col('AMOUNT') > 0)
-            .sort('SUBCATEGORY')
-        )
+        income_category = get_income_category(categories, self.config_file)
+        data = self._calculate(CalculateUtils.calculate_income_sources, transactions, income_category)
         pieplot = None
         if data.shape[0] > 0:
             pieplot = self.plot_pieplot(data)
         return pieplot
 
-    def display_goals_heatmap(self, transactions: pl.DataFrame) -> go.Figure:
+    @profiled
+    def display_goals_heatmap(
+        self,
+        transactions: Frame,
+        time_frame_col: str = 'YEAR_MONTH',
+        category_col: str = 'CATEGORY',
+    ) -> go.Figure:
         """Display a heatmap of goal achievements.
 
         Args:
-            transactions (pl.DataFrame): Input DataFrame containing transaction data.
+            transactions (Frame): Input (Lazy)DataFrame containing transaction data.
+            time_frame_col (str): Name of the column of the periods the goals are set for.
+            category_col (str): Name of the column of the (sub)categories the goals are set for.
 
         Returns:
             go.Figure: Plotly figure object representing the heatmap.
         """
-        goals_df = CalculateUtils.calculate_goals(transactions, self.config_file['goals'])
-        heatmap = self._plot_goals_heatmap(goals_df)
+        args = (self.config_file['goals'], time_frame_col, category_col)
+        goals_df = self._calculate(CalculateUtils.calculate_goals, transactions, *args)
+        heatmap = self._get_figure(
+            self._plot_goals_heatmap,
+            self._calculation_key(CalculateUtils.calculate_goals, args),
+            (),
+            goals_df,
+            time_frame_col,
+            category_col,
+        )
         return heatmap
 
 
+def get_dashboard_calculations(
+    transactions: pl.LazyFrame,
+    balance_index: pl.LazyFrame,
+    time_frame_col: str,
+    category_col: str,
+    start_date: str,
+    end_date: str,
+    sources: List[str],
+    goals: Optional[Dict[str, int]],
+    income_category: Optional[str],
+) -> List[Tuple[Any, ...]]:
+    """Get all the calculations of the dashboard, to calculate them at once with `PlotUtils.calculate_all`.
+
+    The goals are only calculated if there are any, the income sources only if the income category is known.
+    """
+    calculations = [
+        (CalculateUtils.calculate_net_value, balance_index, time_frame_col, start_date, end_date),
+        (CalculateUtils.calculate_net_value_tiles, balance_index, time_frame_col, start_date, end_date),
+        (CalculateUtils.calculate_income_outcome, transactions, sources, time_frame_col, category_col),
+        (CalculateUtils.calculate_transactions_per_category, transactions, category_col, time_frame_col),
+    ]
+    if goals:
+        calculations.append((CalculateUtils.calculate_goals, transactions, goals, 'YEAR_MONTH', 'CATEGORY'))
+    if income_category is not None:
+        calculations.append((CalculateUtils.calculate_income_sources, transactions, income_category))
+    return calculations
+
+
+@st.cache_resource
+def get_precompute_executor() -> ThreadPoolExecutor:
+    """The thread pool that precomputes the dashboards in the background, shared by all sessions."""
+    return ThreadPoolExecutor(max_workers=precompute_workers, thread_name_prefix='precompute_dashboard')
+
+
+@st.cache_resource
+def get_precompute_jobs() -> Dict[str, List[Future]]:
+    """The background jobs per dataset id (see `precompute_dashboard`), while some of them are not done."""
+    return {}
+
+
+def get_income_category(categories: List[str], config: Dict[str, Any]) -> Optional[str]:
+    """The income category of the dashboard: the one of the config if it is one of the categories, else the first.
+
+    None if there are no categories.
+    """
+    if config.get('income_category') in categories:
+        return config['income_category']
+    return categories[0] if categories else None
+
+
+def _log_failed_job(job: Future) -> None:
+    """Log the exception of a background job that failed. Its calculations are then done when they are displayed."""
+    if not job.cancelled() and job.exception() is not None:
+        logger.error('Precomputing the dashboard failed', exc_info=job.exception())
+
+
+def _prune_precompute_jobs() -> None:
+    """Forget the jobs of the datasets whose jobs are all done."""
+    jobs = get_precompute_jobs()
+    for dataset_id, dataset_jobs in list(jobs.items()):
+        if all(job.done() for job in dataset_jobs):
+            jobs.pop(dataset_id, None)
+
+
+def precompute_dashboard(dataset: SessionDataset, config: Dict[str, Any]) -> None:
+    """Precompute the dashboard of a dataset in the background, for every time frame and category level.
+
+    The dashboard over the whole history (the default date range) is calculated for every combination of the tabs,
+    with all sources selected, on a thread pool. The results go to the calculation cache, so switching between
+    the tabs is a cache hit once the jobs are done.
+    """
+    start_date, end_date = get_first_last_date(dataset.cube)
+    transactions = filter_data(dataset.cube, start_date, end_date).lazy()
+    sources = transactions.select(pl.col(source_col).unique().sort()).collect().to_series().to_list()
+    # A copy, the jobs should not see later changes to the config of the session
+    plot_utils = PlotUtils(dict(config), data_fingerprint=(dataset.dataset_id, start_date, end_date))
+
+    _prune_precompute_jobs()
+    executor = get_precompute_executor()
+    jobs = [
+        executor.submit(
+            plot_utils.calculate_all,
+            get_dashboard_calculations(
+                transactions,
+                dataset.balance_index.lazy(),
+                time_frame_col,
+                category_col,
+                start_date,
+                end_date,
+                sources,
+                config.get('goals'),
+                # The income category the dashboard is displayed with, so the calculations are found in the cache
+                get_income_category(dataset.categories, config),
+            ),
+        )
+        for time_frame_col in time_frame_mapping.values()
+        for category_col in category_col_mapping.values()
+    ]
+    for job in jobs:
+        job.add_done_callback(_log_failed_job)
+    get_precompute_jobs()[dataset.dataset_id] = jobs
+
+
+def display_precompute_progress(dataset_id: str) -> None:
+    """Display the progress of precomputing the dashboard of a dataset, while it is not done yet.
+
+    The jobs that failed are not counted as done, the dashboard calculates what they did not.
+    """
+    jobs = get_precompute_jobs().get(dataset_id, [])
+    if all(job.done() for job in jobs):
+        _prune_precompute_jobs()
+        return
+    n_done = sum(job.done() and not job.cancelled() and job.exception() is None for job in jobs)
+    st.progress(n_done / len(jobs), text='Preparing all the time frames and categories in the background...')
+
+
 def display_faq() -> None:
     """Display frequently asked questions and their answers in expandable sections."""
     with st.expander('**How do I get my transactions?**'):
@@ -476,29 +880,83 @@ def display_faq() -> None:
         st.stop()
 
 
-def display_contact_info() -> None:
-    """Display contact information and links in the sidebar."""
-    with st.sidebar:
-        st.markdown(
-            """
-        Get in touch / notify any bugs:
-        """,
-        )
-        mention(label='Narek Arakelyan', icon='github', url='https://github.com/NarekAra')
-
+@st.fragment
+def display_data(
+    get_data: Callable[[Optional[List[str]]], pl.DataFrame],
+    all_sources: List[str],
+    sources: List[str],
+) -> None:
+    """Display the transactions of the selected sources in a dataframe.
 
-def display_data(data: pl.DataFrame) -> None:
-    """Display data in a dataframe."""
+    The sources selected on the dashboard are selected by default. `get_data` loads the transactions of the selected
+    sources (None for all of them) with their search index (see `build_search_index`). Only one page of the (filtered)
+    data is displayed. A fragment: selecting sources, searching and paging only reruns the Data Preview, not the whole
+    dashboard.
+    """
     if st.session_state.dashboardconfig['display_data']:
         with st.expander('Data Preview'):
-            name = st.text_input('Filter the data')
-            if name:
-                filtered_data = data.filter(
-                    pl.any_horizontal(pl.col('*').cast(pl.Utf8).str.to_lowercase().str.contains(name.lower())),
-                )
-            else:
-                filtered_data = data
-            st.dataframe(filtered_data)
+            selected_sources = st.multiselect(label='Sources', options=all_sources, default=sources)
+            data = get_data(None if set(selected_sources) == set(all_sources) else selected_sources)
+            name = st.text_input('Filter the data', help='Shows the transactions that contain all the words.')
+            filtered_data = search_transactions(data, name)
+            n_pages = max(math.ceil(filtered_data.height / data_preview_page_size), 1)
+            page = 1
+            if n_pages > 1:
+                page = st.number_input(f'Page (of {n_pages})', min_value=1, max_value=n_pages, value=1)
+            page_data = filtered_data.slice((page - 1) * data_preview_page_size, data_preview_page_size)
+            st.dataframe(to_display_amounts(page_data.drop(search_col), [amount_col]))
+            st.caption(f'{filtered_data.height} transactions')
+
+
+def display_profile(profiler: Profiler) -> None:
+    """Display the stages of a profiled rerun in the sidebar, as a waterfall, and a download of its Chrome trace."""
+    stages = pl.DataFrame(
+        [
+            {
+                # Numbered, so every stage has its own row, in the order they started
+                'STAGE': f'{i}. {"· " * stage.depth}{stage.name}',
+                'START_MS': stage.start * 1000,
+                'END_MS': (stage.start + stage.seconds) * 1000,
+                'MS': round(stage.seconds * 1000, 1),
+                'ROWS_IN': stage.rows_in,
+                'ROWS_OUT': stage.rows_out,
+                'PEAK_MEMORY_MB': None if stage.peak_memory is None else round(stage.peak_memory / 1024**2, 2),
+                'DEPTH': stage.depth,
+            }
+            for i, stage in enumerate(profiler.stages, start=1)
+        ],
+        schema={
+            'STAGE': pl.String,
+            'START_MS': pl.Float64,
+            'END_MS': pl.Float64,
+            'MS': pl.Float64,
+            'ROWS_IN': pl.Int64,
+            'ROWS_OUT': pl.Int64,
+            'PEAK_MEMORY_MB': pl.Float64,
+            'DEPTH': pl.Int64,
+        },
+    )
+    waterfall = (
+        alt.Chart(stages)
+        .mark_bar()
+        .encode(
+            x=alt.X('START_MS', title='ms'),
+            x2='END_MS',
+            y=alt.Y('STAGE', sort=None, title=None),
+            color=alt.Color('DEPTH:O', legend=None),
+            tooltip=['STAGE', 'MS', 'ROWS_IN', 'ROWS_OUT', 'PEAK_MEMORY_MB'],
+        )
+    )
+    with st.sidebar.expander('Profile of the rerun', expanded=True):
+        st.caption(f'{profiler.seconds * 1000:.0f} ms, {stages.height} stages')
+        if stages.height:
+            st.altair_chart(waterfall, width='stretch')
+        st.download_button(
+            label='Download the Chrome trace',
+            data=json.dumps(profiler.to_chrome_trace()),
+            file_name='rerun_trace.json',
+            mime='application/json',
+        )
 
 
 def display_date_picker(first_and_last_date: Tuple[dt.date, dt.date]) -> Tuple[dt.date, dt.date]:
@@ -531,7 +989,7 @@ def display_tabs() -> Tuple[str, str]:
             ui.tabs(options=mapping.keys(), default_value=next(iter(mapping.keys())), key=next(iter(mapping.keys()))),
         )
 
-    time_frame_section, category_section, _ = st.columns([3, 3, 6])
+    time_frame_section, category_section, _ = st.columns([5, 3, 4])
     with time_frame_section:
         time_frame_col = _create_tabs(time_frame_mapping)
     with category_section:
@@ -540,8 +998,8 @@ def display_tabs() -> Tuple[str, str]:
 
 
 def display_sources(all_sources: List[str]) -> List[str]:
-    """Display a multi-select widget for choosing sources."""
-    sources = st.multiselect(label='Sources', options=all_sources, default=all_sources)
+    """Display a multi-select widget for choosing sources. The selection is kept in the session state as 'sources'."""
+    sources = st.multiselect(label='Sources', options=all_sources, default=all_sources, key='sources')
     return sources
 
 
@@ -680,20 +1138,6 @@ def _add_subcategory(category: str, subcategory: str) -> None:
         st.stop()
 
 
-def _add_rule(rule: str, subcategory: str) -> None:
-    """Add a rule to the config."""
-    if rule:
-        if rule not in st.session_state.config_to_categorize['SUBCATEGORIES'][subcategory]:
-            st.session_state.config_to_categorize['SUBCATEGORIES'][subcategory].append(rule)
-            st.rerun()
-        else:
-            st.warning(f"Rule '{rule}' already exists in subcategory '{subcategory}'. Please enter a different rule.")
-            st.stop()
-    else:
-        st.warning('Please enter a rule.')
-        st.stop()
-
-
 def _delete_category(category: str) -> None:
     """Delete a category from the config."""
     st.sidebar.success(st.session_state._subcategory_to_category)
@@ -702,7 +1146,6 @@ def _delete_category(category: str) -> None:
         del st.session_state.config_to_categorize['SUBCATEGORIES'][subcategory]
         del st.session_state._subcategory_to_category[subcategory]
     del st.session_state.config_to_categorize['CATEGORIES'][category]
-    st.rerun()
 
 
 def _delete_subcategory(subcategory: str) -> None:
@@ -712,18 +1155,48 @@ def _delete_subcategory(subcategory: str) -> None:
     st.session_state.config_to_categorize['CATEGORIES'][category].remove(subcategory)
     del st.session_state.config_to_categorize['SUBCATEGORIES'][subcategory]
     del st.session_state._subcategory_to_category[subcategory]
-    st.rerun()
 
 
-def _delete_rule(subcategory: str, rule: str) -> None:
-    """Delete a rule from the config."""
-    st.session_state.config_to_categorize['SUBCATEGORIES'][subcategory].remove(rule)
-    st.rerun()
+def _apply_rule_edits(page_rules: pd.DataFrame, edited_rules: pd.DataFrame) -> None:
+    """Apply the edits of a page of rules to the config, all at once.
 
-
-def _get_rules(subcategory: str) -> List[str]:
-    """Get the rules for a subcategory."""
-    return st.session_state.config_to_categorize['SUBCATEGORIES'].get(subcategory, [])
+    The rows are matched on their index (the editor keeps the index of the rows on the page). Only the rows the user
+    edited are applied: the rules of the deleted and changed rows are removed, then the (stripped) rules of the
+    changed and added rows are added. The other rules are left as they are.
+    """
+    subcategories = st.session_state.config_to_categorize['SUBCATEGORIES']
+    before = dict(zip(page_rules.index, page_rules.itertuples(index=False, name=None)))
+    after = dict(zip(edited_rules.index, edited_rules.itertuples(index=False, name=None)))
+    edited = [index for index, row in after.items() if before.get(index) != row]
+    for index, (subcategory, rule) in before.items():
+        if after.get(index) != (subcategory, rule):
+            subcategories[subcategory].remove(rule)
+    for subcategory, rule in (after[index] for index in edited):
+        if pd.isna(subcategory) or pd.isna(rule) or not rule.strip():
+            continue
+        if rule.strip() not in subcategories[subcategory]:
+            subcategories[subcategory].append(rule.strip())
+
+
+@st.cache_resource(max_entries=10)
+def _get_rule_index(fingerprint: str, _config: Dict[str, Any]) -> pl.DataFrame:  # noqa: ARG001
+    """The rules of a categorize mapping config, one row per rule, with a search index (see `build_search_index`).
+
+    Cached on the fingerprint of the config, so the index is only built again after the config is edited.
+    """
+    category_of = {subcategory: category for category, names in _config['CATEGORIES'].items() for subcategory in names}
+    rules = pl.DataFrame(
+        [
+            (category_of.get(subcategory), subcategory, rule)
+            for subcategory, subcategory_rules in _config['SUBCATEGORIES'].items()
+            for rule in subcategory_rules
+        ],
+        schema={'CATEGORY': pl.String, 'SUBCATEGORY': pl.String, 'RULE': pl.String},
+        orient='row',
+    )
+    return rules.with_columns(
+        pl.concat_str(pl.all(), separator=' ', ignore_nulls=True).str.to_lowercase().alias(search_col),
+    )
 
 
 def _get_subcategories(category: str) -> List[str]:
@@ -731,8 +1204,57 @@ def _get_subcategories(category: str) -> List[str]:
     return st.session_state.config_to_categorize['CATEGORIES'][category]
 
 
+def display_rule_editor() -> None:
+    """Display the rules of the categorization config in an editor, one page of the (searched) rules at a time.
+
+    The editor is a form: rules can be added, changed and deleted in a batch, which is applied with a single rerun
+    when it is saved. Only the rules on the page are rendered, so large configs do not slow down the editor.
+    """
+    config = st.session_state.config_to_categorize
+    rule_index = _get_rule_index(get_config_fingerprint(config), config)
+    query = st.text_input(
+        'Search the rules',
+        key='rule_search',
+        help='Shows the rules of which the rule, subcategory or category contain all the words.',
+    )
+    rules = search_transactions(rule_index, query)
+    n_pages = max(math.ceil(rules.height / rule_editor_page_size), 1)
+    page = 1
+    if n_pages > 1:
+        page = st.number_input(f'Page (of {n_pages})', min_value=1, max_value=n_pages, value=1)
+    page_rules = rules.slice((page - 1) * rule_editor_page_size, rule_editor_page_size).select('SUBCATEGORY', 'RULE')
+
+    # The editor keeps its edits in the session state, so every page (and search) has its own
+    editor_key = f'rule_editor_{query}_{page}'
+    with st.form('rule_editor_form', border=False):
+        edited_rules = st.data_editor(
+            page_rules.to_pandas(),
+            key=editor_key,
+            num_rows='dynamic',
+            hide_index=True,
+            column_config={
+                'SUBCATEGORY': st.column_config.SelectboxColumn(
+                    'Subcategory',
+                    options=sorted(config['SUBCATEGORIES']),
+                    required=True,
+                ),
+                'RULE': st.column_config.TextColumn('Rule', required=True),
+            },
+        )
+        save = st.form_submit_button('Save the rules')
+    st.caption(f'{rules.height} rules')
+    if save:
+        _apply_rule_edits(page_rules.to_pandas(), edited_rules)
+        del st.session_state[editor_key]  # The edits are in the config now
+        st.rerun()
+
+
 def display_current_categorization_config_structure() -> None:
-    """Display the current categorization config structure."""
+    """Display the current categorization config structure.
+
+    The categories and subcategories are displayed with their number of rules, the rules themselves are edited in
+    the rule editor (see `display_rule_editor`).
+    """
     # Add new category
     col1, col2 = st.columns([5, 1])
     new_category = col1.text_input(
@@ -745,40 +1267,22 @@ def display_current_categorization_config_structure() -> None:
         _add_category(new_category)
     for category in st.session_state.config_to_categorize['CATEGORIES']:
         col1, col2 = st.columns([5, 1])
+        col2.button('🗑️', key=f'del_cat_{category}', on_click=_delete_category, args=(category,))
         with col1.expander(category):
-            if col2.button('🗑️', key=f'del_cat_{category}'):
-                _delete_category(category)
-
             for subcategory in _get_subcategories(category):
                 col1, col2 = st.columns([6, 1])
+                n_rules = len(st.session_state.config_to_categorize['SUBCATEGORIES'].get(subcategory, []))
                 col1.markdown(
                     f'<div class="flex-container subcategory"><span class="label">{subcategory}</span></div>',
                     unsafe_allow_html=True,
                 )
-                if col2.button('🗑️', key=f'del_subcat_{category}-{subcategory}'):
-                    _delete_subcategory(subcategory)
-
-                rules = _get_rules(subcategory)
-                if rules:
-                    for rule in rules:
-                        _, rule_col1, rule_col2 = st.columns([1, 5, 1])
-                        rule_col1.markdown(
-                            f'<div class="flex-container rule"><span class="label">{rule}</span></div>',
-                            unsafe_allow_html=True,
-                        )
-                        if rule_col2.button('🗑️', key=f'del_rule_{category}-{subcategory}_{rule}'):
-                            _delete_rule(subcategory, rule)
-                else:
-                    st.markdown('*No rules in this subcategory*')
-                _, rule_col1, rule_col2 = st.columns([1, 5, 1])
-                new_rule = rule_col1.text_input(
-                    'New rule',
-                    key=f'new_rule_{subcategory}',
-                    label_visibility='collapsed',
-                    placeholder='New rule',
+                col1.caption(f'{n_rules} rules' if n_rules else '*No rules in this subcategory*')
+                col2.button(
+                    '🗑️',
+                    key=f'del_subcat_{category}-{subcategory}',
+                    on_click=_delete_subcategory,
+                    args=(subcategory,),
                 )
-                if rule_col2.button('➕ Rule', key=f'add_rule_{category}-{subcategory}'):
-                    _add_rule(new_rule, subcategory)
             col1, col2 = st.columns([6, 1])
             new_subcategory = col1.text_input(
                 'New subcategory',
@@ -788,3 +1292,6 @@ def display_current_categorization_config_structure() -> None:
             )
             if col2.button('➕ Subcategory', key=f'add_subcat_{category}'):
                 _add_subcategory(category, new_subcategory)
+
+    st.markdown('**Rules**')
+    display_rule_editor()
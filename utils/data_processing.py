@@ -3,16 +3,30 @@
 import datetime as dt
 import re
 from io import BytesIO
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple, Union
 
 import pandas as pd
-import pandera as pa
 import polars as pl
 import streamlit as st
 
-from utils import date_col
+from utils import (
+    amount_col,
+    categorical_cols,
+    category_col,
+    date_col,
+    minor_units,
+    profiled,
+    row_id_col,
+    search_col,
+    source_col,
+    subcategory_col,
+    time_frame_interval,
+    time_frame_mapping,
+    type_col,
+)
 
 
+@profiled
 def categorize_data(data: pd.DataFrame, config: Dict[str, Any], first_time: bool = True) -> pd.DataFrame:
     """Categorize transactions by checking if a 'rule' is contained in the description column."""
     if first_time:
@@ -48,6 +62,25 @@ def categorize_data(data: pd.DataFrame, config: Dict[str, Any], first_time: bool
     return data
 
 
+def apply_cell_edits(transactions: pl.DataFrame, edits: List[Dict[str, Any]]) -> pl.DataFrame:
+    """Apply the cells edited in the grid to the transactions.
+
+    Every edit has the row id, the column and the new value of the cell. The new values are cast to the type of
+    their column. If a cell is edited more than once, the last edit wins.
+    """
+    for column in dict.fromkeys(edit['column'] for edit in edits):
+        column_edits = [edit for edit in edits if edit['column'] == column]
+        new_values = pl.DataFrame({
+            row_id_col: pl.Series([edit['row_id'] for edit in column_edits], dtype=transactions.schema[row_id_col]),
+            column: pl.Series([edit['new_value'] for edit in column_edits]).cast(
+                transactions.schema[column],
+                strict=False,
+            ),
+        }).unique(row_id_col, keep='last', maintain_order=True)
+        transactions = transactions.update(new_values, on=row_id_col, include_nulls=True)
+    return transactions
+
+
 def validate_data_after_categorization(data_to_validate: pd.DataFrame) -> None:
     """Validates the processed data.
 
@@ -95,64 +128,218 @@ def validate_data_after_categorization(data_to_validate: pd.DataFrame) -> None:
         )  # not sure what the point of this is anymore
 
 
-def get_first_last_date(transactions: pd.DataFrame):
-    """Returns the first and last date in the data. Used to set the date picker."""
+def to_iso_date(date: Any) -> str:
+    """Convert a date (or a date string from the date picker) to YYYY-MM-DD."""
+    if isinstance(date, dt.date):
+        return date.isoformat()
     # 0:10 to get the string that indicates YYYY-MM-DD
-    first_date = transactions.select(date_col).min().item()  # [0:10]
-    last_date = transactions.select(date_col).max().item()  # [0:10]
-    return first_date, last_date
+    return str(date)[0:10]
+
+
+def _is_sorted_on_date(data: Union[pl.DataFrame, pl.LazyFrame]) -> bool:
+    """Whether the data is flagged as sorted on DATE (e.g. the daily cube), without checking all the dates."""
+    return isinstance(data, pl.DataFrame) and data.get_column(date_col).flags['SORTED_ASC']
+
 
+def get_first_last_date(transactions: pl.DataFrame) -> Tuple[str, str]:
+    """Returns the first and last date (YYYY-MM-DD) in the data. Used to set the date picker."""
+    if _is_sorted_on_date(transactions) and not transactions.is_empty():
+        dates = transactions.get_column(date_col)
+        return to_iso_date(dates.first()), to_iso_date(dates.last())
+    first_date = transactions.select(date_col).min().item()
+    last_date = transactions.select(date_col).max().item()
+    return to_iso_date(first_date), to_iso_date(last_date)
 
-def filter_data(data: pl.DataFrame, start_date: dt.date, end_date: dt.date):
-    """Filters the data to the selected date range."""
+
+@profiled
+def filter_data(data: Union[pl.DataFrame, pl.LazyFrame], start_date: Any, end_date: Any):
+    """Filters the data to the selected date range.
+
+    If the data is sorted on DATE, the range is found with a binary search and sliced, which does not copy the data.
+    """
+    start_date, end_date = dt.date.fromisoformat(to_iso_date(start_date)), dt.date.fromisoformat(to_iso_date(end_date))
+    if _is_sorted_on_date(data):
+        dates = data.get_column(date_col)
+        offset = dates.search_sorted(start_date, side='left')
+        return data.slice(offset, max(dates.search_sorted(end_date, side='right') - offset, 0))
     data = data.filter((pl.col(date_col) >= start_date) & (pl.col(date_col) <= end_date))
     return data
 
 
+def to_native_types(transactions_data: pl.DataFrame) -> pl.DataFrame:
+    """Parse DATE as a date and make the source and (sub)categories categorical.
+
+    All group-bys, sorts and filters of the dashboard then run on dates and categoricals instead of strings.
+    """
+    if transactions_data.schema[date_col] == pl.String:
+        transactions_data = transactions_data.with_columns(pl.col(date_col).str.strptime(pl.Date, '%Y-%m-%d'))
+    return transactions_data.with_columns(
+        pl.col(col).cast(pl.Categorical) for col in categorical_cols if col in transactions_data.columns
+    )
+
+
+@profiled
 def add_columns(transactions_data: pl.DataFrame):
-    """Add some columns to help out with the dashboard."""
-    if str(transactions_data.get_column('DATE').dtype) == 'String':
-        transactions_data = transactions_data.with_columns([
-            pl.col('DATE').str.strptime(pl.Date, '%Y-%m-%d').alias('DATE'),
-        ])
-    transactions_data = transactions_data.with_columns(
-        pl.col('DATE').dt.strftime('%Y-%m').alias('YEAR_MONTH'),
-        pl.col('DATE').dt.strftime('%YW%V').alias('YEAR_WEEK'),
-        pl.when(pl.col('AMOUNT') > 0).then(pl.lit('INCOMING')).otherwise(pl.lit('OUTGOING')).alias('TYPE'),
-        pl.col('DATE').cast(pl.String),
+    """Add some columns to help out with the dashboard.
+
+    The periods are dates (the first day of the month or week), they are only formatted when plotting.
+    """
+    transactions_data = to_native_types(transactions_data).with_columns(
+        *(
+            pl.col(date_col).dt.truncate(interval).alias(time_frame_col)
+            for time_frame_col, interval in time_frame_interval.items()
+            if time_frame_col != date_col
+        ),
+        pl.when(pl.col(amount_col) > 0)
+        .then(pl.lit('INCOMING'))
+        .otherwise(pl.lit('OUTGOING'))
+        .cast(pl.Categorical)
+        .alias(type_col),
     )
     return transactions_data
 
 
-def validate_transactions_data(data_to_validate: pd.DataFrame) -> None:
-    """Validates the transactions data. Checks if the columns are present and if the data is valid."""
-    data_to_validate = data_to_validate.copy()
-    if 'DATE' not in data_to_validate.columns:
-        st.error(f"Column 'DATE' not in dataframe. Columns in dataframe: {list(data_to_validate.columns)}")
-        st.stop()
+def _parse_date(dtype: pl.DataType) -> pl.Expr:
+    """Parse DATE as a date. Invalid dates become null."""
+    if dtype == pl.String:
+        # 0:10 to get the string that indicates YYYY-MM-DD
+        return pl.col(date_col).str.slice(0, 10).str.to_date('%Y-%m-%d', strict=False)
+    return pl.col(date_col).cast(pl.Date, strict=False)
+
+
+def _parse_amount() -> pl.Expr:
+    """Parse AMOUNT as a float. Invalid amounts become null."""
+    return pl.col(amount_col).cast(pl.Float64, strict=False)
+
+
+@st.cache_data(max_entries=10)
+def get_transactions_validation_errors(content_hash: str, _transactions: pl.DataFrame) -> pl.DataFrame:  # noqa: ARG001
+    """Validate the transactions in a single pass and return the invalid ones with their errors.
+
+    The result is cached on the content hash of the uploaded file (the transactions themselves are not hashed, hence
+    the underscore), so the same file is only validated once.
+    The row numbers match the rows in the excel file (the header is the first row).
+    """
+    checks = {
+        f'{date_col}: invalid date': _parse_date(_transactions.schema[date_col]).is_null(),
+        f'{amount_col}: invalid amount': _parse_amount().is_null(),
+        **{f'{col}: missing value': pl.col(col).is_null() for col in categorical_cols},
+    }
+    errors = pl.concat_str(
+        [pl.when(check).then(pl.lit(error)) for error, check in checks.items()],
+        separator='; ',
+        ignore_nulls=True,
+    )
+    return (
+        _transactions.with_row_index('ROW', offset=2)
+        .filter(pl.any_horizontal(checks.values()))
+        .select('ROW', errors.alias('ERRORS'), date_col, amount_col, *categorical_cols)
+    )
+
 
-    data_to_validate['DATE'] = pd.to_datetime(data_to_validate['DATE'], errors='coerce')
+def build_daily_cube(transactions: pl.DataFrame) -> pl.DataFrame:
+    """Pre-aggregate the transactions per day, source, (sub)category and type.
 
-    if data_to_validate['DATE'].isna().sum() > 0:
-        st.error('Please check the DATE column. It contains invalid values.')
+    All the dashboard computations are sums over these dimensions, so they give the same result on the cube as on
+    the transactions themselves. Their cost then scales with the number of days x groups instead of the number of
+    transactions. The weekly, monthly, quarterly and yearly periods are kept as columns, to roll up to.
+    The cube is sorted on DATE, so date ranges can be sliced out of it (see `filter_data`).
+    """
+    cube = (
+        add_columns(transactions)
+        .group_by(*time_frame_mapping.values(), source_col, category_col, subcategory_col, type_col)
+        .agg(pl.sum(amount_col).alias(amount_col))
+        .sort(date_col)
+    )
+    return cube
+
+
+def build_balance_index(transactions: pl.DataFrame) -> pl.DataFrame:
+    """Build the balance index: the balance of every source at the end of every day with transactions.
+
+    It is a prefix sum per source over the whole history (the transactions or the daily cube), so the balance of a
+    source at any date is the last balance on or before that date. Looking it up is a binary search instead of a
+    cumulative sum over the selected date range, and it does not restart at zero at the start of the range.
+    """
+    balance_index = (
+        transactions.group_by(source_col, date_col)
+        .agg(pl.sum(amount_col).alias(amount_col))
+        .sort(source_col, date_col)
+        .select(date_col, source_col, pl.col(amount_col).cum_sum().over(source_col).alias('BALANCE'))
+        .sort(date_col)
+    )
+    return balance_index
+
+
+def validate_transactions_data(transactions: pl.DataFrame, content_hash: str) -> None:
+    """Validates the transactions data. Checks if the columns are present and if the data is valid."""
+    missing_columns = [col for col in [date_col, amount_col, *categorical_cols] if col not in transactions.columns]
+    if missing_columns:
+        st.error(f'Columns {missing_columns} not in dataframe. Columns in dataframe: {transactions.columns}')
         st.stop()
 
-    # Define the schema
-    schema = pa.DataFrameSchema({
-        'AMOUNT': pa.Column(float, nullable=False),
-        'SUBCATEGORY': pa.Column(str, nullable=False),
-        'CATEGORY': pa.Column(str, nullable=False),
-        'SOURCE': pa.Column(str, nullable=False),
-    })
-
-    # Validate the DataFrame
-    try:
-        schema.validate(data_to_validate)
-    except pa.errors.SchemaError as e:
-        st.error(e)
+    errors = get_transactions_validation_errors(content_hash, transactions)
+    if errors.height > 0:
+        st.error(f'{errors.height} transactions contain invalid values. Please check these rows in your file:')
+        st.dataframe(errors, hide_index=True)
         st.stop()
 
 
+def prepare_transactions_data(transactions: pl.DataFrame, amounts_in_minor_units: bool = False) -> pl.DataFrame:
+    """Give the validated transactions their native types. Other (optional) text columns are filled with ''.
+
+    With `amounts_in_minor_units`, the amounts are stored as exact integers in cents instead of floats. All sums
+    over them are then exact, e.g. the net value does not drift by a few cents after years of transactions.
+    """
+    other_text_cols = [
+        col
+        for col, dtype in transactions.schema.items()
+        if dtype == pl.String and col not in [date_col, *categorical_cols]
+    ]
+    transactions = transactions.with_columns(
+        _parse_date(transactions.schema[date_col]),
+        _parse_amount(),
+        pl.col(categorical_cols).cast(pl.String),
+        pl.col(other_text_cols).fill_null(''),
+    )
+    if amounts_in_minor_units:
+        transactions = transactions.with_columns((pl.col(amount_col) * minor_units).round(0).cast(pl.Int64))
+    return to_native_types(transactions)
+
+
+def get_amount_scale(transactions: Union[pl.DataFrame, pl.LazyFrame]) -> int:
+    """Returns how many units of the AMOUNT column make up 1.0: integer amounts are in minor units (cents)."""
+    return minor_units if transactions.collect_schema()[amount_col].is_integer() else 1
+
+
+def to_display_amounts(transactions: pl.DataFrame, amount_cols: List[str]) -> pl.DataFrame:
+    """Convert amounts (and aggregates of them) in minor units back to floats. Only done right before displaying."""
+    return transactions.with_columns(
+        pl.col(col) / minor_units for col in amount_cols if transactions.schema[col].is_integer()
+    )
+
+
+def build_search_index(transactions: pl.DataFrame) -> pl.DataFrame:
+    """Add the search index to the transactions: the lowercase text of every row (as displayed) in SEARCH_TEXT.
+
+    Searching is then a single scan over one column, instead of casting and lowercasing every column on every
+    keystroke. The transactions are sorted on DATE, so date ranges can be sliced out (see `filter_data`).
+    """
+    search_text = to_display_amounts(transactions, [amount_col]).select(
+        pl.concat_str(pl.all().cast(pl.String), separator=' ', ignore_nulls=True).str.to_lowercase().alias(search_col),
+    )
+    return pl.concat([transactions, search_text], how='horizontal').sort(date_col, maintain_order=True)
+
+
+def search_transactions(transactions: pl.DataFrame, query: str) -> pl.DataFrame:
+    """Get the transactions (with a search index) in which every word of the query occurs."""
+    words = query.lower().split()
+    if not words:
+        return transactions
+    return transactions.filter(pl.all_horizontal(pl.col(search_col).str.contains(word, literal=True) for word in words))
+
+
+@profiled
 def df_to_excel(df: pd.DataFrame) -> bytes:
     """Write df as excel file."""
     # Function to convert DataFrame to Excel
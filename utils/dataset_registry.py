@@ -0,0 +1,139 @@
+"""A registry of the datasets of all sessions, so identical datasets are only kept in memory once."""
+
+import contextlib
+import os
+import shutil
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional, Tuple
+
+import polars as pl
+import pyarrow as pa
+import streamlit as st
+
+from utils import dataset_registry_max_bytes, get_content_hash, paths
+
+
+def get_frame_hash(frame: pl.DataFrame) -> str:
+    """The content hash of a frame: frames with the same schema and rows have the same hash."""
+    row_hashes = frame.hash_rows(seed=0).to_numpy().tobytes()
+    return get_content_hash(str(frame.schema).encode() + row_hashes)
+
+
+class DatasetLease:
+    """The reference of a session to a dataset in the registry.
+
+    A dataset is removed from the registry once its last lease is released: with `release`, or when the lease is
+    garbage collected, e.g. with the session state of a session that ended.
+    """
+
+    def __init__(self, registry: 'DatasetRegistry', key: str):
+        """Initialize a lease on a dataset. The registry has already counted it."""
+        self.key = key
+        self._finalizer = weakref.finalize(self, registry._release, key)
+
+    def release(self) -> None:
+        """Release the dataset. Releasing it again has no effect."""
+        self._finalizer()
+
+
+class DatasetRegistry:
+    """Holds the datasets of all sessions, deduplicated on their content hash.
+
+    The sessions only keep a lease on their dataset (see `DatasetLease`). A dataset is an immutable polars frame
+    (Arrow buffers), so every session that gets it shares the same memory instead of a copy. The registry is bounded
+    on the (estimated) size of the datasets it keeps in memory: above that, the least recently used datasets are
+    spilled to Arrow IPC files on disk. A spilled dataset is memory-mapped from its file, so the OS only keeps the
+    parts that are read in memory. A dataset that no session has a lease on anymore is removed, and so is its file.
+    It is thread safe, so one instance can be shared by all sessions.
+    """
+
+    def __init__(self, max_bytes: int, spill_dir: str = paths['dataset_spill']):
+        """Initialize an empty registry. The files of a previous process are removed from the spill directory."""
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.size = 0
+        # The dataset, its size in memory, and whether it is spilled to disk
+        self._entries: OrderedDict[str, Tuple[pl.DataFrame, int, bool]] = OrderedDict()
+        self._leases: Dict[str, int] = defaultdict(int)  # The number of leases on every dataset
+        # Reentrant, as a lease can be garbage collected (and released) while the lock is held
+        self._lock = threading.RLock()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    def __contains__(self, key: str) -> bool:
+        """Whether the dataset is in the registry."""
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: str) -> pl.DataFrame:
+        """Get a dataset and mark it as most recently used. Raises a KeyError if it is not in the registry."""
+        with self._lock:
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def lease(self, key: str) -> Optional[DatasetLease]:
+        """Lease a dataset, or None if it is not in the registry."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            self._leases[key] += 1
+            return DatasetLease(self, key)
+
+    def put(self, frame: pl.DataFrame, key: Optional[str] = None) -> DatasetLease:
+        """Add a dataset, unless a dataset with the same key is already in the registry. Returns a lease on it.
+
+        The key defaults to the content hash of the frame (see `get_frame_hash`). Uploaded files can use the
+        content hash of the file instead, so they do not have to be parsed again if they are already registered.
+        """
+        key = key if key is not None else get_frame_hash(frame)
+        with self._lock:
+            lease = self.lease(key)  # The same dataset, shared instead of kept twice
+            if lease is not None:
+                return lease
+            frame = frame.rechunk()  # One contiguous buffer per column
+            size = frame.estimated_size()
+            self._entries[key] = (frame, size, False)
+            self.size += size
+            lease = self.lease(key)
+            self._spill_least_recently_used()
+        return lease
+
+    def _release(self, key: str) -> None:
+        """Release a lease on a dataset, and remove the dataset if it was the last one."""
+        with self._lock:
+            self._leases[key] -= 1
+            if self._leases[key] > 0:
+                return
+            del self._leases[key]
+            _, size, spilled = self._entries.pop(key)
+            self.size -= size
+        if spilled:  # The frames that are still read keep the file mapped until they are done with it
+            with contextlib.suppress(OSError):  # E.g. on Windows, where a file that is mapped cannot be removed
+                os.remove(self._spill_path(key))
+
+    def _spill_path(self, key: str) -> str:
+        """The file a dataset is spilled to."""
+        return os.path.join(self.spill_dir, f'{key}.arrow')
+
+    def _spill_least_recently_used(self) -> None:
+        """Spill the least recently used datasets to disk until the registry fits in its byte budget."""
+        for key, (frame, size, spilled) in list(self._entries.items()):
+            if self.size <= self.max_bytes:
+                return
+            if spilled or key not in self._entries:  # Spilled, or removed since
+                continue
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = self._spill_path(key)
+            frame.write_ipc(path, compression='uncompressed')  # Uncompressed, so it can be memory-mapped
+            # Zero-copy: the frame reads its buffers from the memory-mapped file
+            spilled_frame = pl.from_arrow(pa.ipc.open_file(pa.memory_map(path)).read_all())
+            self._entries[key] = (spilled_frame, 0, True)
+            self.size -= size
+
+
+@st.cache_resource
+def get_dataset_registry() -> DatasetRegistry:
+    """The registry of the datasets, shared by all sessions."""
+    return DatasetRegistry(dataset_registry_max_bytes)
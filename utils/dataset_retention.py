@@ -0,0 +1,62 @@
+"""The retention of the uploaded datasets: their stores are deleted `transaction_store_retention_days` after the upload.
+
+Only the files of the stores are looked at here, so the app can check for expired stores when it starts without
+importing the stores themselves (and polars).
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import List
+
+import streamlit as st
+
+from utils import dataset_expiry_interval_seconds, paths, transaction_store_retention_days
+
+logger = logging.getLogger(__name__)
+
+
+def remove_store_path(path: str) -> None:
+    """Remove a store from disk: a file, or a directory (e.g. the partitions of a Parquet archive)."""
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def get_expired_stores(
+    root: str = paths['transaction_store'],
+    retention_days: int = transaction_store_retention_days,
+) -> List[str]:
+    """The paths of the stores that were written more than `retention_days` ago."""
+    if not os.path.isdir(root):
+        return []
+    expiry = time.time() - retention_days * 24 * 60 * 60
+    paths_in_root = (os.path.join(root, name) for name in os.listdir(root))
+    return [path for path in paths_in_root if os.path.getmtime(path) < expiry]
+
+
+def _expire_datasets_periodically() -> None:
+    """Delete the expired datasets, now and then every `dataset_expiry_interval_seconds`."""
+    while True:
+        try:
+            if get_expired_stores():
+                from utils import delete_expired_datasets  # Imports the stores, only when there is something to delete
+
+                delete_expired_datasets()
+        except Exception:
+            logger.exception('Deleting the expired datasets failed')
+        time.sleep(dataset_expiry_interval_seconds)
+
+
+@st.cache_resource
+def start_dataset_expiry() -> threading.Thread:
+    """Start deleting the expired datasets in the background, once per process (when the app starts).
+
+    The datasets are then deleted on time, also when nobody opens the app.
+    """
+    thread = threading.Thread(target=_expire_datasets_periodically, name='dataset_expiry', daemon=True)
+    thread.start()
+    return thread
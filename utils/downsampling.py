@@ -0,0 +1,78 @@
+"""Downsampling of the chart data, so the number of points sent to the browser does not grow with the history."""
+
+import math
+
+import numpy as np
+import polars as pl
+
+from utils import time_frame_interval
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets (LTTB) downsampling.
+
+    The first and last point are always kept. The points in between are split in n_out - 2 buckets, and of every
+    bucket the point that forms the largest triangle with the previously kept point and the average of the next
+    bucket is kept. This keeps the peaks and the shape of the line.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    kept = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = (end, edges[bucket + 2]) if bucket + 2 < len(edges) else (n - 1, n)
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Twice the area of the triangles, the factor does not matter for the largest one
+        areas = np.abs(
+            (x[kept] - next_x) * (y[start:end] - y[kept]) - (x[kept] - x[start:end]) * (next_y - y[kept]),
+        )
+        kept = start + int(np.argmax(areas))
+        indices[bucket + 1] = kept
+    return indices
+
+
+def downsample_lines(lines: pl.DataFrame, x_col: str, y_col: str, group_col: str, max_points: int) -> pl.DataFrame:
+    """Downsample every line (group) with LTTB, so all lines together have about max_points points."""
+    if lines.height <= max_points:
+        return lines
+    groups = lines.partition_by(group_col, maintain_order=True)
+    points_per_line = max(max_points // len(groups), 3)
+    downsampled = []
+    for line in groups:
+        line = line.sort(x_col)
+        # Dates are downsampled on their physical value (days since epoch)
+        x = line.get_column(x_col).to_physical().to_numpy().astype(float)
+        y = line.get_column(y_col).to_numpy().astype(float)
+        downsampled.append(line[lttb_indices(x, y, points_per_line)])
+    return pl.concat(downsampled)
+
+
+def downsample_bars(
+    bars: pl.DataFrame,
+    time_frame_col: str,
+    y_col: str,
+    group_col: str,
+    max_points: int,
+) -> pl.DataFrame:
+    """Merge consecutive periods into buckets, so there are about max_points bars.
+
+    The number of periods per bucket adapts to the number of periods and groups. The bars are summed per bucket and
+    group, and a bucket is labelled with its first period, e.g. every 3 months for monthly bars.
+    """
+    if bars.height <= max_points:
+        return bars
+    n_periods = bars.get_column(time_frame_col).n_unique()
+    n_groups = bars.get_column(group_col).n_unique()
+    periods_per_bucket = math.ceil(n_periods * n_groups / max_points)
+    # E.g. '1mo' becomes '3mo'
+    bucket_interval = f'{periods_per_bucket}{time_frame_interval[time_frame_col].lstrip("1")}'
+    return (
+        bars.group_by(pl.col(time_frame_col).dt.truncate(bucket_interval), group_col)
+        .agg(pl.sum(y_col))
+        .sort(group_col, time_frame_col)
+        .select(time_frame_col, group_col, y_col)
+    )
@@ -0,0 +1,81 @@
+"""The log of the edits to the categorized transactions, with undo and redo."""
+
+from typing import Any, Dict, List
+
+import polars as pl
+
+from utils import apply_cell_edits, row_id_col
+
+Edit = Dict[str, Any]
+
+
+def get_cell_edits(before: pl.DataFrame, after: pl.DataFrame) -> List[Edit]:
+    """The edits of the cells that differ between two versions of the transactions, matched on their row id."""
+    after = after.select(before.columns)
+    joined = before.join(after, on=row_id_col, suffix='_NEW')
+    edits = []
+    for column in before.columns:
+        if column == row_id_col:
+            continue
+        changed = joined.filter(pl.col(column).ne_missing(pl.col(f'{column}_NEW')))
+        edits.extend(
+            {'row_id': row_id, 'column': column, 'old_value': old_value, 'new_value': new_value}
+            for row_id, old_value, new_value in changed.select(row_id_col, column, f'{column}_NEW').iter_rows()
+        )
+    return edits
+
+
+class EditLog:
+    """An append-only log of the edits to the categorized transactions.
+
+    Every action (e.g. the edits of one grid update or filling in the categories) is a list of edits of single
+    cells: the row id, the column, and the old and new value. The edited transactions are materialized on demand, by
+    applying the log to the (shared) categorized transactions, so the session only keeps the edits instead of a copy
+    of the transactions per action. Undone actions can be redone, until a new action is recorded.
+    """
+
+    def __init__(self):
+        """Initialize an empty log."""
+        self._actions: List[List[Edit]] = []
+        self._undone: List[List[Edit]] = []
+
+    def __len__(self) -> int:
+        """The number of edits in the log."""
+        return sum(len(action) for action in self._actions)
+
+    @property
+    def can_undo(self) -> bool:
+        """Whether there is an action to undo."""
+        return bool(self._actions)
+
+    @property
+    def can_redo(self) -> bool:
+        """Whether there is an undone action to redo."""
+        return bool(self._undone)
+
+    def record(self, edits: List[Edit]) -> None:
+        """Record the edits as one action. Edits that do not change the value are left out."""
+        edits = [edit for edit in edits if edit['old_value'] != edit['new_value']]
+        if edits:
+            self._actions.append(edits)
+            self._undone.clear()
+
+    def undo(self) -> None:
+        """Undo the last action."""
+        if self._actions:
+            self._undone.append(self._actions.pop())
+
+    def redo(self) -> None:
+        """Redo the last undone action."""
+        if self._undone:
+            self._actions.append(self._undone.pop())
+
+    def clear(self) -> None:
+        """Remove all the edits, e.g. when other transactions are uploaded."""
+        self._actions.clear()
+        self._undone.clear()
+
+    def materialize(self, transactions: pl.DataFrame) -> pl.DataFrame:
+        """Apply the edits in the log to the transactions, in the order they were made."""
+        edits = [edit for action in self._actions for edit in action]
+        return apply_cell_edits(transactions, edits) if edits else transactions
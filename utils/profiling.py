@@ -0,0 +1,184 @@
+"""Per-stage profiling of a rerun, in debug mode.
+
+The stages of a rerun (e.g. `add_columns`, the dashboard calculations and plots, the Excel I/O) are recorded with
+their wall time, their rows in and out, and their peak memory. Outside of a profiled rerun (see `profile_rerun`),
+profiling a stage only costs a lookup of the current profiler. Only the stages that run on the thread of the rerun
+are recorded, e.g. not the precomputations of the dashboard.
+"""
+
+import contextvars
+import functools
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class Stage:
+    """A stage of a rerun. The start is in seconds since the start of the rerun."""
+
+    def __init__(self, name: str, depth: int = 0, start: float = 0.0):
+        """Initialize a stage that starts now."""
+        self.name = name
+        self.depth = depth  # The number of stages it is nested in
+        self.start = start
+        self.seconds = 0.0
+        self.rows_in: Optional[int] = None
+        self.rows_out: Optional[int] = None
+        self.peak_memory: Optional[int] = None  # In bytes
+        self.thread_id = threading.get_ident()
+
+
+class Profiler:
+    """Records the stages of one rerun.
+
+    The peak memory of a stage is the peak of the memory allocated by Python (traced by tracemalloc, including
+    pandas and numpy) during the stage, above what was allocated when it started. Memory allocated by polars (in
+    Rust) is not traced.
+    """
+
+    def __init__(self):
+        """Initialize a profiler without stages, the rerun starts now."""
+        self.start = time.perf_counter()
+        self.seconds = 0.0  # The wall time of the rerun, once it is done
+        self.stages: List[Stage] = []
+        # The highest traced memory so far of every stage that is running, the innermost last
+        self._peaks: List[int] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        """Record a stage. The rows in and out can be set on the stage that is yielded."""
+        stage = Stage(name, depth=len(self._peaks), start=time.perf_counter() - self.start)
+        self.stages.append(stage)
+        tracing = tracemalloc.is_tracing()
+        start_memory, peak = tracemalloc.get_traced_memory()
+        if self._peaks:  # The peak is reset for this stage, so it is kept for the stage it is nested in first
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        tracemalloc.reset_peak()
+        self._peaks.append(start_memory)
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - self.start - stage.start
+            peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            if tracing:
+                stage.peak_memory = peak - start_memory
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """The stages in the Chrome trace event format, which can be opened in chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        events = [
+            {
+                'name': stage.name,
+                'ph': 'X',  # A complete event: a start and a duration
+                'ts': round(stage.start * 1e6),  # In microseconds
+                'dur': round(stage.seconds * 1e6),
+                'pid': pid,
+                'tid': stage.thread_id,
+                'args': {
+                    'rows_in': stage.rows_in,
+                    'rows_out': stage.rows_out,
+                    'peak_memory_bytes': stage.peak_memory,
+                },
+            }
+            for stage in self.stages
+        ]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+# The profiler of the rerun that is running on this thread, if it is profiled
+_current_profiler: contextvars.ContextVar[Optional[Profiler]] = contextvars.ContextVar('profiler', default=None)
+
+
+class _MemoryTracing:
+    """Traces the memory allocations while any profiled rerun is running.
+
+    tracemalloc is process-wide, so it is started by the first profiled rerun and only stopped once the last one is
+    done, instead of by every rerun (which would stop the tracing of the reruns of other sessions halfway).
+    """
+
+    def __init__(self):
+        """Initialize without tracing."""
+        self._lock = threading.Lock()
+        self._reruns = 0  # The profiled reruns that are running
+        self._started = False  # Whether the tracing was started here, and not e.g. with PYTHONTRACEMALLOC
+
+    @contextmanager
+    def trace(self) -> Iterator[None]:
+        """Trace the memory allocations while in the context."""
+        with self._lock:
+            if self._reruns == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            self._reruns += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reruns -= 1
+                if self._reruns == 0 and self._started:
+                    tracemalloc.stop()
+                    self._started = False
+
+
+_memory_tracing = _MemoryTracing()
+
+
+@contextmanager
+def profile_rerun() -> Iterator[Profiler]:
+    """Profile the stages of a rerun (see `profile_stage`).
+
+    The memory allocations are traced during the rerun, which slows it down (and any rerun that runs at the same
+    time), so the wall times are only comparable with each other. The peak memory of the stages is approximate when
+    other reruns are profiled at the same time, as it is traced for the whole process.
+    """
+    profiler = Profiler()
+    token = _current_profiler.set(profiler)
+    with _memory_tracing.trace():
+        try:
+            yield profiler
+        finally:
+            profiler.seconds = time.perf_counter() - profiler.start
+            _current_profiler.reset(token)
+
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[Stage]:
+    """Profile a stage of the rerun, if the rerun is profiled. The rows in and out can be set on the stage yielded."""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield Stage(name)
+        return
+    with profiler.stage(name) as stage:
+        yield stage
+
+
+def _count_rows(value: Any) -> Optional[int]:
+    """The number of rows of a (polars or pandas) frame, None for anything else, e.g. a LazyFrame."""
+    shape = getattr(value, 'shape', None)
+    return shape[0] if isinstance(shape, tuple) and shape else None
+
+
+def profiled(func: F) -> F:
+    """Profile every call of a function as a stage, with the rows of its first frame argument and of its result."""
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if _current_profiler.get() is None:
+            return func(*args, **kwargs)
+        with profile_stage(func.__qualname__) as stage:
+            stage.rows_in = next(
+                (rows for rows in map(_count_rows, (*args, *kwargs.values())) if rows is not None),
+                None,
+            )
+            result = func(*args, **kwargs)
+            stage.rows_out = _count_rows(result)
+        return result
+
+    return wrapper
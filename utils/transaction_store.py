@@ -0,0 +1,445 @@
+"""Embedded stores for the categorized transactions."""
+
+import datetime as dt
+import os
+import re
+import secrets
+import shutil
+import sqlite3
+import urllib.request
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import polars as pl
+import streamlit as st
+
+from utils import (
+    amount_col,
+    build_balance_index,
+    build_daily_cube,
+    build_search_index,
+    category_col,
+    date_col,
+    get_calculation_cache,
+    get_expired_stores,
+    paths,
+    remove_store_path,
+    source_col,
+    subcategory_col,
+    to_iso_date,
+    to_native_types,
+    transaction_store_retention_days,
+)
+
+# A dataset id is random (see `new_dataset_id`), ids of older uploads have a suffix if the amounts are stored in cents.
+# The ids also come from a cookie, so they are validated before they become part of a path.
+dataset_id_pattern = re.compile(r'[0-9a-f]{64}(-cents)?')
+
+
+def new_dataset_id() -> str:
+    """A new dataset id for an upload.
+
+    Every upload gets its own store, also if other sessions uploaded the same file, so deleting it does not delete
+    the data of other sessions. The id can not be guessed from the file either.
+    """
+    return secrets.token_hex(32)
+
+
+class TransactionStore(ABC):
+    """Persists the categorized transactions of one dataset on disk.
+
+    Every uploaded dataset gets its own store, named after its dataset id. The store can be queried on a date
+    range and sources, so these filters are pushed down instead of reading the whole history (see
+    `get_search_index`).
+    """
+
+    extension = ''
+
+    def __init__(self, dataset_id: str, root: str = paths['transaction_store']):
+        """Initialize the store of the given dataset. Raises a ValueError if the dataset id is not valid."""
+        if not dataset_id_pattern.fullmatch(dataset_id):
+            msg = f'Invalid dataset id: {dataset_id!r}'
+            raise ValueError(msg)
+        self.dataset_id = dataset_id
+        self.path = os.path.join(root, f'{dataset_id}{self.extension}')
+
+    def exists(self) -> bool:
+        """Whether the dataset has been written to the store."""
+        return os.path.exists(self.path)
+
+    def delete(self) -> None:
+        """Delete the transactions from the store, if they were written to it."""
+        remove_store_path(self.path)
+
+    def _check_exists(self) -> None:
+        """Raise a FileNotFoundError if the store does not exist (anymore), e.g. it expired while it was open."""
+        if not self.exists():
+            msg = f'The store of dataset {self.dataset_id} does not exist'
+            raise FileNotFoundError(msg)
+
+    @staticmethod
+    def _normalize(transactions: pl.DataFrame) -> pl.DataFrame:
+        """Everything but the date and the amount is stored as text (the source and (sub)categories as categoricals)."""
+        return to_native_types(transactions.with_columns(pl.exclude(date_col, amount_col).cast(pl.String)))
+
+    @abstractmethod
+    def write(self, transactions: pl.DataFrame) -> None:
+        """Write the (validated and prepared) transactions to the store, replacing the ones that were there before."""
+
+    @abstractmethod
+    def read(
+        self,
+        start_date: Optional[Any] = None,
+        end_date: Optional[Any] = None,
+        sources: Optional[List[str]] = None,
+    ) -> pl.DataFrame:
+        """Read the transactions within the date range (and of the given sources only), sorted by date.
+
+        DATE is returned as a date, the source and (sub)categories as categoricals.
+        """
+
+    @abstractmethod
+    def get_date_range(self) -> Optional[Tuple[str, str]]:
+        """The first and last date (YYYY-MM-DD) of the transactions, without reading them. None if there are none."""
+
+
+class SQLiteTransactionStore(TransactionStore):
+    """Stores the transactions in a local SQLite database, indexed on DATE, SOURCE and CATEGORY."""
+
+    extension = '.sqlite'
+    table = 'transactions'
+    indexed_columns = (date_col, source_col, category_col)
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        # A new connection per call, because Streamlit can run the script on a different thread every rerun.
+        if read_only:  # Does not create an empty database if the store was deleted
+            return sqlite3.connect(f'file:{urllib.request.pathname2url(self.path)}?mode=ro', uri=True)
+        return sqlite3.connect(self.path)
+
+    def write(self, transactions: pl.DataFrame) -> None:
+        """Write the (validated and prepared) transactions to the store, replacing the ones that were there before."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # DATE is stored as YYYY-MM-DD text, so it still sorts chronologically
+        transactions = self._normalize(transactions).with_columns(
+            pl.col(date_col).dt.strftime('%Y-%m-%d'),
+            pl.exclude(date_col, amount_col).cast(pl.String),
+        )
+        columns = transactions.columns
+        column_definitions = ', '.join(f'"{col}" {self._column_type(transactions.schema[col])}' for col in columns)
+        placeholders = ', '.join('?' for _ in columns)
+
+        connection = self._connect()
+        try:
+            with connection:  # Commits the transaction
+                connection.execute(f'DROP TABLE IF EXISTS {self.table}')
+                connection.execute(f'CREATE TABLE {self.table} ({column_definitions})')
+                connection.executemany(
+                    f'INSERT INTO {self.table} VALUES ({placeholders})',
+                    transactions.iter_rows(),
+                )
+                for col in self.indexed_columns:
+                    connection.execute(f'CREATE INDEX idx_{col.lower()} ON {self.table} ("{col}")')
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _column_type(dtype: pl.DataType) -> str:
+        """SQLite column type. Amounts are either floats or integers (in minor units), the rest is text."""
+        if dtype.is_integer():
+            return 'INTEGER'
+        return 'REAL' if dtype.is_float() else 'TEXT'
+
+    def _schema(self, connection: sqlite3.Connection) -> Dict[str, pl.DataType]:
+        """Polars schema of the transactions table. Needed to type empty query results."""
+        table_info = connection.execute(f'PRAGMA table_info({self.table})').fetchall()
+        column_dtypes = {'INTEGER': pl.Int64, 'REAL': pl.Float64, 'TEXT': pl.String}
+        return {name: column_dtypes[col_type] for _, name, col_type, *_ in table_info}
+
+    @staticmethod
+    def _build_filter(
+        start_date: Optional[Any] = None,
+        end_date: Optional[Any] = None,
+        sources: Optional[List[str]] = None,
+    ) -> Tuple[str, List[str]]:
+        """Build the WHERE clause (and its parameters) for the date range and sources. Both columns are indexed."""
+        conditions, parameters = ['1 = 1'], []
+        if start_date is not None:
+            conditions.append(f'"{date_col}" >= ?')
+            parameters.append(to_iso_date(start_date))
+        if end_date is not None:
+            conditions.append(f'"{date_col}" <= ?')
+            parameters.append(to_iso_date(end_date))
+        if sources is not None:
+            conditions.append(f'"{source_col}" IN ({", ".join("?" for _ in sources)})')
+            parameters.extend(sources)
+        return ' AND '.join(conditions), parameters
+
+    def read(
+        self,
+        start_date: Optional[Any] = None,
+        end_date: Optional[Any] = None,
+        sources: Optional[List[str]] = None,
+    ) -> pl.DataFrame:
+        """Read the transactions within the date range (and of the given sources only), sorted by date."""
+        self._check_exists()
+        where, parameters = self._build_filter(start_date, end_date, sources)
+        connection = self._connect(read_only=True)
+        try:
+            transactions = pl.read_database(
+                f'SELECT * FROM {self.table} WHERE {where} ORDER BY "{date_col}"',
+                connection,
+                execute_options={'parameters': parameters},
+                schema_overrides=self._schema(connection),
+            )
+        finally:
+            connection.close()
+        return to_native_types(transactions)
+
+    def get_date_range(self) -> Optional[Tuple[str, str]]:
+        """The first and last date (YYYY-MM-DD) of the transactions, looked up in the DATE index."""
+        self._check_exists()
+        connection = self._connect(read_only=True)
+        try:
+            first_date, last_date = connection.execute(
+                f'SELECT MIN("{date_col}"), MAX("{date_col}") FROM {self.table}',
+            ).fetchone()
+        finally:
+            connection.close()
+        return None if first_date is None else (first_date, last_date)
+
+
+class ParquetTransactionStore(TransactionStore):
+    """Archives the transactions as Parquet files, partitioned by YEAR and MONTH (hive style).
+
+    Meant for long histories: the archive is scanned lazily with `pl.scan_parquet` and the date range is also
+    expressed on the partition columns, so only the partitions of the selected months are read from disk.
+    The transactions are archived with their native types (dates and categoricals).
+    """
+
+    extension = '.parquet'
+    partition_cols = ('YEAR', 'MONTH')
+
+    def write(self, transactions: pl.DataFrame) -> None:
+        """Write the (validated and prepared) transactions to the store, replacing the ones that were there before."""
+        shutil.rmtree(self.path, ignore_errors=True)
+        transactions = (
+            self._normalize(transactions)
+            .sort(date_col)
+            .with_columns(
+                pl.col(date_col).dt.year().alias('YEAR'),
+                pl.col(date_col).dt.month().alias('MONTH'),
+            )
+        )
+        transactions.write_parquet(self.path, partition_by=list(self.partition_cols))
+
+    @staticmethod
+    def _month_key(date: str) -> int:
+        """Integer key YYYYMM of the month of a date, to compare the partitions with the date range."""
+        return int(date[0:4]) * 100 + int(date[5:7])
+
+    def _scan(
+        self,
+        start_date: Optional[Any] = None,
+        end_date: Optional[Any] = None,
+        sources: Optional[List[str]] = None,
+    ) -> pl.LazyFrame:
+        """Lazily scan the transactions. Partitions outside of the date range are pruned."""
+        self._check_exists()
+        transactions = pl.scan_parquet(self.path, hive_partitioning=True)
+        partition_key = pl.col('YEAR') * 100 + pl.col('MONTH')
+        if start_date is not None:
+            start_date = to_iso_date(start_date)
+            transactions = transactions.filter(
+                (partition_key >= self._month_key(start_date))
+                & (pl.col(date_col) >= dt.date.fromisoformat(start_date)),
+            )
+        if end_date is not None:
+            end_date = to_iso_date(end_date)
+            transactions = transactions.filter(
+                (partition_key <= self._month_key(end_date)) & (pl.col(date_col) <= dt.date.fromisoformat(end_date)),
+            )
+        if sources is not None:
+            transactions = transactions.filter(pl.col(source_col).is_in(sources))
+        return transactions
+
+    def read(
+        self,
+        start_date: Optional[Any] = None,
+        end_date: Optional[Any] = None,
+        sources: Optional[List[str]] = None,
+    ) -> pl.DataFrame:
+        """Read the transactions within the date range (and of the given sources only), sorted by date."""
+        return (
+            self._scan(start_date, end_date, sources)
+            .drop(*self.partition_cols)
+            .sort(date_col, maintain_order=True)
+            .collect()
+        )
+
+    def get_date_range(self) -> Optional[Tuple[str, str]]:
+        """The first and last date (YYYY-MM-DD) of the transactions. Only the DATE column is read from the archive."""
+        dates = self._scan().select(pl.col(date_col).min().alias('FIRST'), pl.col(date_col).max().alias('LAST'))
+        first_date, last_date = dates.collect().row(0)
+        return None if first_date is None else (to_iso_date(first_date), to_iso_date(last_date))
+
+
+transaction_stores = {'sqlite': SQLiteTransactionStore, 'parquet': ParquetTransactionStore}
+
+
+@st.cache_resource(max_entries=10)
+def get_daily_cube(dataset_id: str, _store: TransactionStore) -> pl.DataFrame:  # noqa: ARG001
+    """Get the daily cube of a dataset (see `build_daily_cube`).
+
+    It is built once and cached on the dataset id, so it is shared by all sessions. It is cached as a resource: every
+    rerun gets the same (immutable) frame instead of a copy, so slicing a date range out of it does not copy anything.
+    The store is read one year at a time and every year is aggregated on its own, so only the transactions of a
+    single year are in memory at once, not the whole archive. A day is in one year only, so the cubes of the years
+    are simply concatenated (in order, so the cube stays sorted on DATE).
+    """
+    date_range = _store.get_date_range()
+    if date_range is None:
+        return build_daily_cube(_store.read())
+    first_year, last_year = (int(date[0:4]) for date in date_range)
+    cube = pl.concat(
+        [build_daily_cube(_store.read(f'{year}-01-01', f'{year}-12-31')) for year in range(first_year, last_year + 1)],
+        rechunk=True,
+    )
+    return cube.set_sorted(date_col)
+
+
+@st.cache_resource(max_entries=10)
+def get_balance_index(dataset_id: str, _store: TransactionStore) -> pl.DataFrame:
+    """Get the balance index of a dataset (see `build_balance_index`), built once from its daily cube."""
+    return build_balance_index(get_daily_cube(dataset_id, _store))
+
+
+@st.cache_resource(max_entries=10)
+def get_search_index(
+    dataset_id: str,  # noqa: ARG001
+    start_date: str,
+    end_date: str,
+    sources: Optional[Tuple[str, ...]],
+    _store: TransactionStore,
+) -> pl.DataFrame:
+    """Get the transactions of a dataset within a date range, with their search index (see `build_search_index`).
+
+    Only the date range and the sources (None for all of them) are read from the store (the filters are pushed down),
+    and the index is cached per dataset, range and sources, so it is built once for all sessions.
+    """
+    return build_search_index(_store.read(start_date, end_date, None if sources is None else list(sources)))
+
+
+class SessionDataset:
+    """The prepared data of the dataset of a session, kept in the session state as `dataset`.
+
+    The daily cube and the balance index are the frames shared by all sessions (see `get_daily_cube`), so they are
+    not copied per session. The distinct categories, sources and the subcategories per category are computed once
+    from the cube, so the pages can read them on every rerun without querying the store again.
+    """
+
+    def __init__(self, store: TransactionStore):
+        """Prepare the data of the dataset in the given store."""
+        self.store = store
+        self.dataset_id = store.dataset_id
+        self.cube = get_daily_cube(self.dataset_id, store)
+        self.balance_index = get_balance_index(self.dataset_id, store)
+        self.categories = self._get_distinct(category_col)
+        self.sources = self._get_distinct(source_col)
+        subcategories = (
+            self.cube.select(pl.col(category_col, subcategory_col).cast(pl.String))
+            .unique()
+            .sort(category_col, subcategory_col)
+            .group_by(category_col, maintain_order=True)
+            .agg(subcategory_col)
+        )
+        self._subcategories: Dict[str, List[str]] = dict(subcategories.iter_rows())
+
+    def _get_distinct(self, column: str) -> List[str]:
+        """The sorted distinct values of a column of the cube."""
+        return self.cube.get_column(column).cast(pl.String).unique().sort().to_list()
+
+    def get_search_index(
+        self,
+        start_date: str,
+        end_date: str,
+        sources: Optional[List[str]] = None,
+    ) -> pl.DataFrame:
+        """The transactions of the sources (all of them by default) within the date range, with their search index.
+
+        See `get_search_index`.
+        """
+        sources_key = None if sources is None else tuple(sorted(sources))
+        return get_search_index(self.dataset_id, start_date, end_date, sources_key, self.store)
+
+    def get_subcategories(self, category: str) -> List[str]:
+        """The sorted subcategories of a category, e.g. the income sources of the income category."""
+        return self._subcategories.get(category, [])
+
+
+def _mentions(key: Hashable, dataset_id: str) -> bool:
+    """Whether a key of the calculation cache is (partly) built from a dataset, e.g. its data fingerprint."""
+    if isinstance(key, tuple):
+        return any(_mentions(part, dataset_id) for part in key)
+    return key == dataset_id
+
+
+def _evict_dataset(dataset_id: str) -> None:
+    """Remove what was built from a dataset from the shared caches."""
+    # The cached frames can not be cleared per dataset, they are built again from the stores when they are needed
+    for cached in (get_daily_cube, get_balance_index, get_search_index):
+        cached.clear()
+    get_calculation_cache().discard_if(lambda key: _mentions(key, dataset_id))
+
+
+def delete_dataset(dataset_id: str) -> None:
+    """Delete a dataset from the stores of all formats, and the frames built from it from the shared caches."""
+    for store_class in transaction_stores.values():
+        store_class(dataset_id).delete()
+    _evict_dataset(dataset_id)
+
+
+def delete_expired_datasets(
+    root: str = paths['transaction_store'],
+    retention_days: int = transaction_store_retention_days,
+) -> None:
+    """Delete the stores that were written more than `retention_days` ago (see `start_dataset_expiry`)."""
+    for path in get_expired_stores(root, retention_days):
+        remove_store_path(path)
+        _evict_dataset(os.path.basename(path).split('.')[0])
+
+
+def open_dataset(dataset_id: Optional[str]) -> Optional[SessionDataset]:
+    """Open the dataset of a previous session (see `open_transaction_store`). Returns None if it does not exist."""
+    store = open_transaction_store(dataset_id)
+    return SessionDataset(store) if store is not None else None
+
+
+def get_session_dataset() -> Optional[SessionDataset]:
+    """Get the dataset of the session, reopened from the store of a previous session (e.g. after a restart).
+
+    If the store was deleted while the session used it (it expired, or the data was deleted in another session),
+    the dataset is dropped and the user is asked to upload the transactions again.
+    """
+    if st.session_state.dataset is not None and not st.session_state.dataset.store.exists():
+        st.session_state.dataset = None
+        st.warning('Your transactions are no longer stored on the server. Please upload them again.')
+        return None
+    if st.session_state.dataset is None:
+        st.session_state.dataset = open_dataset(st.session_state.cookie_manager.get(cookie='dataset_id'))
+    return st.session_state.dataset
+
+
+def open_transaction_store(dataset_id: Optional[str]) -> Optional[TransactionStore]:
+    """Open the store of a previously uploaded dataset. Returns None if it does not exist (anymore).
+
+    If the dataset was stored in multiple formats, the most recently written store is opened. An invalid dataset id
+    (e.g. a tampered cookie) has no store.
+    """
+    if not dataset_id or not dataset_id_pattern.fullmatch(dataset_id):
+        return None
+    delete_expired_datasets()  # An expired dataset can not be opened anymore
+    stores = [store_class(dataset_id) for store_class in transaction_stores.values()]
+    stores = [store for store in stores if store.exists()]
+    if not stores:
+        return None
+    return max(stores, key=lambda store: os.path.getmtime(store.path))